@@ -1,6 +1,8 @@
 import numpy as np
 from vampyr import vampyr3d as vp
 from typing import Any, List
+import history
+import utils
 
 class KAIN():
     """
@@ -24,13 +26,18 @@ class KAIN():
     func_history : List[List[vp.FunctionTree]]  # vector of vectors of functions
     update_history : List[List[vp.FunctionTree]] # vector of vectors of the function updates
     
-    def __init__(self, history) -> None:
+    def __init__(self, history, store = None, mra = None, prec = None) -> None:
         self.instance_index = len(KAIN.instances)
         self.instances.append(self)
         self.history = history
+        self.store = store  #optional history.HistoryStore keeping the histories within a RAM budget
+        #with an MRA and a precision, the KAIN updates are built in a single addition pass
+        self.mra = mra
+        self.prec = prec
         
         self.func_history = []
         self.update_history = [] 
+        self.grams = []
         
         self.A = []
         self.b = []
@@ -52,8 +59,12 @@ class KAIN():
             tuple(vampyr.vampyr3d.FunctionTree, vampyr.vampyr3d.FunctionTree): input function list and its kain update list
         """
         
-        self.func_history.append(functions)
-        self.update_history.append(functions_updates)
+        if self.store is not None:
+            self.func_history.append(self.store.newHistory(functions))
+            self.update_history.append(self.store.newHistory(functions_updates))
+        else:
+            self.func_history.append(functions)
+            self.update_history.append(functions_updates)
         
         if (len(self.func_history) == 1) or (len(self.update_history) == 1):
             return functions_updates
@@ -73,22 +84,14 @@ class KAIN():
     def setupLinearSystem(self):
         nHistory = len(self.func_history) -1
         nOrbitals = len(self.func_history[nHistory])
+        while len(self.grams) < nOrbitals:
+            self.grams.append(KainGram())
         for n in range(nOrbitals):
-            orbA = np.zeros((nHistory, nHistory))
-            orbB = np.zeros(nHistory)
-            
-            phi_m = self.func_history[nHistory][n]
-            fPhi_m = self.update_history[nHistory][n]
-            
-            for i in range(nHistory):
-                phi_i = self.func_history[i][n]
-                dPhi_im = phi_i - phi_m
-                
-                for j in range(nHistory):
-                    fPhi_j = self.update_history[j][n]
-                    dfPhi_jm = fPhi_j - fPhi_m
-                    orbA[i, j] -= vp.dot(dPhi_im, dfPhi_jm)
-                orbB[i] += vp.dot(dPhi_im, fPhi_m)
+            if self.store is not None:
+                G = self.grams[n].update(history.HistoryColumn(self.func_history, n), history.HistoryColumn(self.update_history, n))
+            else:
+                G = self.grams[n].update([self.func_history[i][n] for i in range(nHistory+1)], [self.update_history[i][n] for i in range(nHistory+1)])
+            orbA, orbB = kainLinearSystem(G)
             self.A.append(orbA)
             self.b.append(orbB)
         return   
@@ -106,6 +109,14 @@ class KAIN():
         nHistory = len(self.func_history) -1
         nOribtals = len(self.func_history[nHistory])
         for n in range(nOribtals):    
+            if self.mra is not None:
+                #fPhi_m + Sum_j c_j*(phi_j + fPhi_j - phi_m - fPhi_m) as one linear combination
+                c = self.c[n]
+                trees = [self.func_history[j][n] for j in range(nHistory)] + [self.update_history[j][n] for j in range(nHistory)]
+                trees += [self.func_history[nHistory][n], self.update_history[nHistory][n]]
+                coefs = list(c) + list(c) + [-np.sum(c), 1. - np.sum(c)]
+                kain_updates.append(utils.linCombOne(coefs, trees, self.prec, self.mra))
+                continue
             phi_m = self.func_history[nHistory][n].deepCopy()
             fPhi_m = self.update_history[nHistory][n].deepCopy()
         
@@ -121,5 +132,73 @@ class KAIN():
         self.A = []
         self.b = []
         self.c = []
-    
-    
\ No newline at end of file
+
+
+class KainGram():
+    """
+    Rolling matrix of the raw inner products G[l, j] = <phi_l|f_j> between the function and update histories of one orbital.
+    An entry is reused as long as both of its trees are still in the histories, so each iteration only computes the
+    products involving the trees added or replaced since the previous call: one new row and one new column instead of the full matrix.
+    Trees are identified by the entry keys of a history.TreeHistory, or by identity for plain lists. In the latter case
+    the trees of the previous call are referenced here, so their ids cannot be reused by new trees.
+    """
+
+    def __init__(self) -> None:
+        self.phiKeys = []
+        self.fKeys = []
+        self.refs = []
+        self.G = np.zeros((0, 0))
+
+    def update(self, phis, fs):
+        """
+        Args:
+            phis (list or history.TreeHistory): function history, oldest first
+            fs (list or history.TreeHistory): update history, oldest first
+
+        Returns:
+            np.ndarray: G[l, j] = <phis[l]|fs[j]>
+        """
+        refs = []
+        phiKeys = self.keysOf(phis, refs)
+        fKeys = self.keysOf(fs, refs)
+        rows = [self.phiKeys.index(key) if key in self.phiKeys else None for key in phiKeys]
+        cols = [self.fKeys.index(key) if key in self.fKeys else None for key in fKeys]
+        G = np.zeros((len(phiKeys), len(fKeys)))
+        for l in range(len(phiKeys)):
+            for j in range(len(fKeys)):
+                if rows[l] is not None and cols[j] is not None:
+                    G[l, j] = self.G[rows[l], cols[j]]
+                else:
+                    G[l, j] = vp.dot(phis[l], fs[j])
+        self.phiKeys, self.fKeys, self.refs, self.G = phiKeys, fKeys, refs, G
+        return G
+
+    @staticmethod
+    def keysOf(trees, refs):
+        if hasattr(trees, "entryKeys"):
+            return [("entry", key) for key in trees.entryKeys()]
+        refs.extend(trees)
+        return [("id", id(tree)) for tree in trees]
+
+    def reset(self):
+        self.phiKeys = []
+        self.fKeys = []
+        self.refs = []
+        self.G = np.zeros((0, 0))
+
+
+def kainLinearSystem(G):
+    """
+    Builds the KAIN linear system Ac = b from the inner products G[l, j] = <phi_l|f_j>, the last entry (m) being the current iterate:
+    A[l, j] = -<phi_l - phi_m|f_j - f_m> and b[l] = <phi_l - phi_m|f_m>, for l, j < m.
+
+    Args:
+        G (np.ndarray): (m+1)x(m+1) matrix of inner products
+
+    Returns:
+        tuple(np.ndarray, np.ndarray): A and b
+    """
+    m = G.shape[0] - 1
+    A = -(G[:m, :m] - G[:m, m:m+1] - G[m:m+1, :m] + G[m, m])
+    b = G[:m, m] - G[m, m]
+    return A, b
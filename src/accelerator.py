@@ -0,0 +1,163 @@
+from abc import ABC, abstractmethod
+import numpy as np
+from vampyr import vampyr3d as vp
+import KAIN
+import utils
+
+#Convergence accelerators of the orbital iterations, one instance per orbital.
+#The solver keeps the last `depth` iterates and updates of every orbital in phi_prev and f_prev, and asks the accelerator
+#for the correction to apply to the current iterate once the new update f_m = G[phi_m] - phi_m has been appended.
+
+class Accelerator(ABC):
+    """
+    Interface of the accelerators.
+    - depth: number of iterates the solver has to keep in its histories for this accelerator
+    - trim(phis, fs): drops the oldest history entries once the new iterate was appended
+    - correction(phis, fs, prec, mra): correction delta, the next iterate being phis[-1] + delta
+    - trees(): trees held by the accelerator itself, on top of the solver histories
+    - reset(): forgets the accumulated history
+    - refresh(): recomputes the cached inner products after the trees were modified in place (cropped)
+    - checkpointState() / restoreState(trees, arrays): own state for the checkpoints, trees being lists of trees by name
+      and arrays np.ndarrays by name. The state of the solver histories is saved by the solver.
+    """
+
+    depth = 1
+
+    @abstractmethod
+    def correction(self, phis, fs, prec, mra):
+        pass
+
+    def trees(self):
+        return []
+
+    def trim(self, phis, fs): #At most one entry per iteration, as the original KAIN loop: two iterates are always kept, so KAIN has a difference vector
+        if len(phis) > self.depth:
+            del phis[0]
+            del fs[0]
+
+    def reset(self):
+        pass
+
+    def refresh(self):
+        pass
+
+    def checkpointState(self):
+        return {}, {}
+
+    def restoreState(self, trees, arrays):
+        pass
+
+
+class KainAccelerator(Accelerator):
+    """
+    KAIN on the last khist iterates and updates held in the solver histories, with the rolling inner products of a KAIN.KainGram.
+    """
+
+    def __init__(self, gram, khist) -> None:
+        self.gram = gram
+        self.depth = khist
+
+    def correction(self, phis, fs, prec, mra):
+        A, b = KAIN.kainLinearSystem(self.gram.update(phis, fs))
+        c = np.linalg.solve(A, b)
+        return kainDelta(phis, fs, c, prec, mra)
+
+    def reset(self):
+        self.gram.reset()
+
+    def refresh(self):
+        self.gram.reset()
+
+
+class CropAccelerator(Accelerator):
+    """
+    CROP (conjugate residual with optimal trial vectors, Ettenhuber and Jorgensen, JCTC 2015).
+    Only the optimal iterates x~ and their residuals r~ of the last `size` steps are kept. At every step the new iterate and
+    update are combined with them into the optimal vectors x~_n = Sum_i c_i x_i, r~_n = Sum_i c_i r_i minimising ||r~_n||
+    under Sum_i c_i = 1, and the next iterate is x~_n + r~_n. For linear problems the optimal vectors carry the whole
+    history, so a small size (3) converges like a much deeper KAIN or DIIS while memory stays constant.
+    The solver only needs to keep the current iterate (depth 1).
+    The residual inner products are kept in B: the new residual costs one dot product per kept vector, the products of
+    the optimal residual follow from the coefficients.
+    """
+
+    def __init__(self, size = 3) -> None:
+        if size < 2:
+            raise ValueError(f"CROP needs at least 2 vectors, got {size}")
+        self.size = size
+        self.xs = []
+        self.rs = []
+        self.B = np.zeros((0, 0))
+
+    def correction(self, phis, fs, prec, mra):
+        x, r = phis[-1], fs[-1]
+        #New residual inner products
+        n = len(self.rs)
+        B = np.zeros((n+1, n+1))
+        B[:n, :n] = self.B
+        for i in range(n):
+            B[i, n] = B[n, i] = vp.dot(self.rs[i], r)
+        B[n, n] = vp.dot(r, r)
+        xs = self.xs + [x]
+        rs = self.rs + [r]
+        c = cropCoefficients(B)
+        #Optimal vectors, replacing the new iterate and residual
+        xOpt = utils.linCombOne(c, xs, prec, mra)
+        rOpt = utils.linCombOne(c, rs, prec, mra)
+        Bc = np.dot(B, c)
+        B[n, :] = Bc
+        B[:, n] = Bc
+        B[n, n] = np.dot(c, Bc)
+        xs[-1], rs[-1] = xOpt, rOpt
+        #Only the size-1 latest optimal vectors are needed by the next step
+        keep = self.size - 1
+        self.xs, self.rs, self.B = xs[-keep:], rs[-keep:], B[-keep:, -keep:]
+        #x_{n+1} = x~_n + r~_n
+        return utils.linCombOne([1., 1., -1.], [xOpt, rOpt, x], prec, mra)
+
+    def trees(self):
+        return self.xs + self.rs
+
+    def trim(self, phis, fs): #The optimal vectors carry the history, only the current iterate is kept
+        while len(phis) > self.depth:
+            del phis[0]
+            del fs[0]
+
+    def reset(self):
+        self.xs = []
+        self.rs = []
+        self.B = np.zeros((0, 0))
+
+    def refresh(self):
+        self.B = np.array([[vp.dot(ri, rj) for rj in self.rs] for ri in self.rs]).reshape(len(self.rs), len(self.rs))
+
+    def checkpointState(self):
+        return {"xs": list(self.xs), "rs": list(self.rs)}, {"B": self.B}
+
+    def restoreState(self, trees, arrays):
+        self.xs = list(trees["xs"])
+        self.rs = list(trees["rs"])
+        self.B = np.asarray(arrays["B"], dtype=float).reshape(len(self.rs), len(self.rs))
+
+
+def cropCoefficients(B):
+    """
+    Minimises c^T B c under Sum_i c_i = 1 through the bordered system [[B, 1], [1^T, 0]] [c, l] = [0, 1].
+    """
+    n = B.shape[0]
+    M = np.zeros((n+1, n+1))
+    M[:n, :n] = B
+    M[:n, n] = 1.
+    M[n, :n] = 1.
+    rhs = np.zeros(n+1)
+    rhs[n] = 1.
+    #lstsq: linearly dependent residuals make the system singular close to convergence
+    return np.linalg.lstsq(M, rhs, rcond=None)[0][:n]
+
+def kainDelta(phis, fs, c, prec, mra): #delta = f_m + Sum_j c_j*(phi_j - phi_m + f_j - f_m), built in a single pass
+    n = len(c)
+    trees = [phis[j] for j in range(n)] + [fs[j] for j in range(n)] + [phis[-1], fs[-1]]
+    coefs = list(c) + list(c) + [-np.sum(c), 1. - np.sum(c)]
+    return utils.linCombOne(coefs, trees, prec, mra)
+
+ACCELERATORS = ("kain", "crop")
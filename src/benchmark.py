@@ -0,0 +1,157 @@
+import sys
+import json
+import time
+import argparse
+import platform
+import subprocess
+import numpy as np
+from vampyr import vampyr3d as vp
+from scfsolv import scfsolv, scfsolv_1stpert
+import ortho
+import utils
+
+#Self-contained performance benchmarks: the starting orbitals are built from analytic Gaussians, no file is read.
+#The solver is closed shell, every orbital is doubly occupied, so "H" is the two-electron system of a single proton.
+#Geometries are in bohr, shifted off the grid origin like the inputs of main.py.
+#Every orbital is a list of primitives (coef, nucleus, exponent, pow), exponents are single Gaussian fits of Slater functions.
+MOLECULES = {
+    "H": {"R": [[0.1, 0.1, 0.1]], "Z": [1],
+          "orbitals": [[(1., 0, 0.283, [0,0,0])]]},
+    "He": {"R": [[0.1, 0.1, 0.1]], "Z": [2],
+           "orbitals": [[(1., 0, 0.808, [0,0,0])]]},
+    "H2": {"R": [[0.1, 0.1, -0.6], [0.1, 0.1, 0.8]], "Z": [1, 1],
+           "orbitals": [[(1., 0, 0.42, [0,0,0]), (1., 1, 0.42, [0,0,0])]]},
+    "LiH": {"R": [[1.508001, 0.188973, 0.188973], [-1.508001, 0.188973, 0.188973]], "Z": [3, 1],
+            "orbitals": [[(1., 0, 2.05, [0,0,0])],
+                         [(0.5, 0, 0.116, [0,0,0]), (1., 1, 0.283, [0,0,0])]]},
+    "H2O": {"R": [[0.0, 0.0, -0.125], [-1.4375, 0.0, 1.025], [1.4375, 0.0, 1.025]], "Z": [8, 1, 1],
+            "orbitals": [[(1., 0, 16.6, [0,0,0])],
+                         [(1., 0, 1.43, [0,0,0]), (0.3, 1, 0.42, [0,0,0]), (0.3, 2, 0.42, [0,0,0])],
+                         [(1., 0, 1.43, [1,0,0]), (-0.3, 1, 0.42, [0,0,0]), (0.3, 2, 0.42, [0,0,0])],
+                         [(1., 0, 1.43, [0,0,1]), (0.3, 1, 0.42, [0,0,0]), (0.3, 2, 0.42, [0,0,0])],
+                         [(1., 0, 1.43, [0,1,0])]]},
+}
+
+def gaussianOrbitals(solver, molecule): #Projects and normalises the analytic starting orbitals of molecule
+    orbitals = []
+    for primitives in molecule["orbitals"]:
+        gauss = vp.GaussExp()
+        for coef, nuc, exp, power in primitives:
+            gauss.append(vp.GaussFunc(exp=exp, coef=coef, pos=molecule["R"][nuc], pow=power))
+        phi = solver.P_eps(gauss)
+        phi.normalize()
+        orbitals.append(phi)
+    return orbitals
+
+def timeit(func, repeats):
+    """
+    Calls func repeats times.
+
+    Returns:
+        dict: min, mean and max wall time in s, and the number of repeats
+    """
+    times = []
+    for k in range(repeats):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return {"min": min(times), "mean": float(np.mean(times)), "max": max(times), "repeats": repeats}
+
+def timeOnce(func): #Single timed call, returns the timing and the result of func
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    return {"min": elapsed, "mean": elapsed, "max": elapsed, "repeats": 1}, result
+
+def lowdinStep(solver): #Full Loewdin step on the current orbitals: overlap, S^-1/2 and the rebuilt orbitals, without the early exit of orthonormalise
+    phi = [solver.phi_prev[orb][-1] for orb in range(solver.Norb)]
+    S = ortho.overlapMatrix(phi, mapper=solver.executor.map)
+    X, U = ortho.lowdinMatrix(S)
+    return utils.linComb(X, phi, solver.prec, solver.mra)
+
+def benchmarkMolecule(name, prec, khist, repeats, thrs, response = True, maxIter = 30):
+    """
+    Times the phases of the SCF, and of a response iteration, for one of the MOLECULES.
+
+    Returns:
+        dict: phase -> timings, plus the number of SCF iterations and the final energies
+    """
+    molecule = MOLECULES[name]
+    solver = scfsolv(prec, khist)
+    out = {}
+    out["init"], result = timeOnce(lambda : solver.init_orbitals(molecule["R"], molecule["Z"], gaussianOrbitals(solver, molecule)))
+    #Individual phases on the initial orbitals, the operator cache is bypassed
+    solver.compFock()
+    out["Vnuc"] = timeit(solver.projectNuclearPotential, repeats)
+    out["computeCoulombPot"] = timeit(solver.computeCoulombPot, repeats)
+    out["computeExchangePotential"] = timeit(lambda : solver.computeExchangePotential(0), repeats)
+    out["computeExchangePotentials"] = timeit(solver.computeExchangePotentials, repeats)
+    out["compFop"] = timeit(lambda : solver.applyFock(0), repeats)
+    out["compFock"] = timeit(lambda : (solver.markOrbitalsChanged(), solver.compFock()), repeats)
+    out["powerIter"] = timeit(lambda : solver.powerIter(0), repeats)
+    out["orthonormalise"] = timeit(lambda : lowdinStep(solver), repeats)
+    #Full SCF, then the KAIN setup on the history it leaves
+    #Capped, a badly converging guess must not stall the benchmark
+    out["scfRun"], iterations = timeOnce(lambda : solver.scfRun(thrs, maxIter=maxIter))
+    perIteration = out["scfRun"]["mean"]/max(iterations, 1)
+    out["scfIteration"] = {"min": perIteration, "mean": perIteration, "max": perIteration, "repeats": iterations}
+    out["kainSetup"] = timeit(lambda : (solver.kainGram[0].reset(), solver.setuplinearsystem(0)), repeats)
+    out["scfIterations"] = iterations
+    out["energies"] = [float(E) for E in solver.E_n]
+    if response:
+        pert = scfsolv_1stpert(solver)
+        pert.init_molec(np.array([0.01, 0., 0.]))
+        out["responseIteration"] = timeit(pert.expandSolution, repeats)
+    return out
+
+def gitCommit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def runBenchmarks(names, prec = 1.0e-3, khist = 5, repeats = 3, thrs = None, response = True, maxIter = 30):
+    if thrs is None:
+        thrs = prec*10
+    results = {"meta": {"commit": gitCommit(), "time": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(),
+                        "numpy": np.__version__, "prec": prec, "khist": khist, "thrs": thrs, "repeats": repeats, "maxIter": maxIter},
+               "molecules": {}}
+    for name in names:
+        results["molecules"][name] = benchmarkMolecule(name, prec, khist, repeats, thrs, response, maxIter)
+    return results
+
+def compare(old, new): #Ratios new/old of the mean time of every phase present in both result files
+    ratios = {}
+    for name, phases in new["molecules"].items():
+        if name not in old["molecules"]:
+            continue
+        ratios[name] = {}
+        for phase, timing in phases.items():
+            oldTiming = old["molecules"][name].get(phase)
+            if isinstance(timing, dict) and isinstance(oldTiming, dict) and oldTiming["mean"] > 0:
+                ratios[name][phase] = timing["mean"]/oldTiming["mean"]
+    return ratios
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Per-phase timings of the SCF and response solvers on synthetic molecules")
+    parser.add_argument("--molecules", nargs="+", default=list(MOLECULES), choices=list(MOLECULES))
+    parser.add_argument("--prec", type=float, default=1.0e-3)
+    parser.add_argument("--khist", type=int, default=5)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--thrs", type=float, default=None, help="SCF convergence threshold, 10*prec by default")
+    parser.add_argument("--max-iter", type=int, default=30, help="maximum number of SCF iterations")
+    parser.add_argument("--no-response", action="store_true", help="skip the response iteration")
+    parser.add_argument("--output", default=None, help="JSON file for the results, stdout by default")
+    parser.add_argument("--compare", default=None, help="previous JSON results, the new/old ratios of the mean times are printed")
+    args = parser.parse_args()
+
+    results = runBenchmarks(args.molecules, args.prec, args.khist, args.repeats, args.thrs, not args.no_response, args.max_iter)
+    if args.output is None:
+        json.dump(results, sys.stdout, indent=2)
+    else:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.compare is not None:
+        with open(args.compare) as f:
+            json.dump(compare(json.load(f), results), sys.stderr, indent=2)
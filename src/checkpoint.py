@@ -0,0 +1,118 @@
+import os
+import json
+import shutil
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from vampyr import vampyr3d as vp
+
+class Checkpointer():
+    """
+    Writes periodic checkpoints of a solver to a single directory, on a background thread so that the SCF loop does not stall.
+    Layout:
+    - directory/ckpt_{n}/state.json: iteration, scalars, arrays and the file names of every tree of the n-th checkpoint
+    - directory/ckpt_{n}/*.tree: the trees, written with saveTree
+    - directory/manifest.json: points to the last complete checkpoint
+    A checkpoint is written to a temporary directory and renamed when complete, and the manifest is only updated afterwards,
+    so a run killed during a write still resumes from the previous checkpoint.
+    """
+
+    def __init__(self, directory, every = 1, keep = 2) -> None:
+        self.directory = directory
+        self.every = every  #checkpoint every `every` iterations
+        self.keep = keep    #number of complete checkpoints kept on disk
+        os.makedirs(directory, exist_ok=True)
+        #Checkpoints are numbered in writing order, continuing the numbering of a previous run in the same directory
+        self.count = 1 + max([int(d[5:]) for d in self.completed()], default=-1)
+        self.pool = ThreadPoolExecutor(max_workers=1)
+        self.pending = None
+
+    def save(self, solver, iteration, force = False):
+        """
+        Takes a snapshot of the solver state and writes it asynchronously.
+        The snapshot only references the trees, which are never modified in place once stored in the histories.
+        """
+        if not force and iteration % self.every != 0:
+            return
+        snapshot = solver.checkpointState()
+        #Only one write in flight, so checkpoints are completed in order
+        self.wait()
+        self.pending = self.pool.submit(self.write, snapshot, iteration, self.count)
+        self.count += 1
+
+    def wait(self):
+        if self.pending is not None:
+            self.pending.result()
+            self.pending = None
+
+    def close(self):
+        self.wait()
+        self.pool.shutdown()
+
+    def write(self, snapshot, iteration, count):
+        name = f"ckpt_{count:06d}"
+        tmp = f"{self.directory}/{name}.tmp"
+        final = f"{self.directory}/{name}"
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        treeFiles = {}
+        for key, histories in snapshot["trees"].items():
+            treeFiles[key] = []
+            for i in range(len(histories)):
+                files = []
+                for h in range(len(histories[i])):
+                    fname = f"{key}_{i}_{h}"
+                    histories[i][h].saveTree(f"{tmp}/{fname}")
+                    files.append(fname)
+                treeFiles[key].append(files)
+        state = {"iteration": iteration,
+                 "values": snapshot["values"],
+                 "arrays": {key: np.asarray(value).tolist() for key, value in snapshot["arrays"].items()},
+                 "trees": treeFiles}
+        with open(f"{tmp}/state.json", "w") as f:
+            json.dump(state, f)
+        shutil.rmtree(final, ignore_errors=True)
+        os.replace(tmp, final)
+        #Atomic manifest update
+        with open(f"{self.directory}/manifest.json.tmp", "w") as f:
+            json.dump({"latest": name, "iteration": iteration, "kind": snapshot["values"].get("kind")}, f)
+        os.replace(f"{self.directory}/manifest.json.tmp", f"{self.directory}/manifest.json")
+        self.cleanup(name)
+
+    def completed(self):
+        return sorted(d for d in os.listdir(self.directory) if d.startswith("ckpt_") and not d.endswith(".tmp"))
+
+    def cleanup(self, latest):
+        for old in self.completed()[:-self.keep]:
+            if old != latest:
+                shutil.rmtree(f"{self.directory}/{old}", ignore_errors=True)
+
+
+def load(directory, mra):
+    """
+    Loads the latest complete checkpoint of directory.
+
+    Args:
+        directory (str): checkpoint directory
+        mra (vampyr.vampyr3d.MultiResolutionAnalysis): MRA of the solver the state is loaded into
+
+    Returns:
+        dict: iteration, values, arrays (as np.ndarray) and trees (lists of lists of vampyr.vampyr3d.FunctionTree)
+    """
+    with open(f"{directory}/manifest.json") as f:
+        manifest = json.load(f)
+    path = f"{directory}/{manifest['latest']}"
+    with open(f"{path}/state.json") as f:
+        state = json.load(f)
+    trees = {}
+    for key, histories in state["trees"].items():
+        trees[key] = []
+        for files in histories:
+            hist = []
+            for fname in files:
+                tree = vp.FunctionTree(mra)
+                tree.loadTree(f"{path}/{fname}")
+                hist.append(tree)
+            trees[key].append(hist)
+    state["arrays"] = {key: np.array(value) for key, value in state["arrays"].items()}
+    state["trees"] = trees
+    return state
@@ -0,0 +1,91 @@
+import numpy as np
+from vampyr import vampyr3d as vp
+import ortho
+import utils
+
+#Initial guess from the core Hamiltonian in a minimal STO-3G basis: no file is needed to start an SCF.
+
+#STO-3G contractions of Slater functions of exponent 1: exponents and coefficients, the exponents scale as zeta^2
+STO3G_1S = ([2.227660584, 0.4057711562, 0.1098175104], [0.1543289673, 0.5353281423, 0.4446345422])
+STO3G_2SP = ([0.9942027190, 0.2310313000, 0.0751386000], [-0.09996722919, 0.3995128261, 0.7001154689], [0.1559162750, 0.6076837186, 0.3919573931])
+
+#Slater exponents (1s, 2sp) of the STO-3G basis
+SLATER_EXPONENTS = {1: (1.24,), 2: (1.69,), 3: (2.69, 0.80), 4: (3.68, 1.15), 5: (4.68, 1.50), 6: (5.67, 1.72),
+                    7: (6.67, 1.95), 8: (7.66, 2.25), 9: (8.65, 2.55), 10: (9.64, 2.88)}
+
+def contractedGaussian(zeta, exponents, coefs, pos, power): #Contracted Gaussian of normalised primitives, as a vp.GaussExp
+    out = vp.GaussExp()
+    for exp, coef in zip(exponents, coefs):
+        alpha = exp*zeta**2
+        norm = (2*alpha/np.pi)**(3./4.)*(2*np.sqrt(alpha))**sum(power)
+        out.append(vp.GaussFunc(exp=alpha, coef=coef*norm, pos=pos, pow=power))
+    return out
+
+def atomicOrbitals(Z, pos):
+    """
+    STO-3G atomic orbitals of an atom: 1s, then 2s, 2px, 2py and 2pz from lithium on.
+
+    Args:
+        Z (int): nuclear charge, up to 10
+        pos (list): position of the nucleus
+
+    Returns:
+        list of vampyr.vampyr3d.GaussExp: the atomic orbitals
+    """
+    if int(Z) not in SLATER_EXPONENTS:
+        raise ValueError(f"No STO-3G guess for Z = {Z}, only H to Ne are supported")
+    zetas = SLATER_EXPONENTS[int(Z)]
+    out = [contractedGaussian(zetas[0], STO3G_1S[0], STO3G_1S[1], pos, [0,0,0])]
+    if len(zetas) > 1:
+        out.append(contractedGaussian(zetas[1], STO3G_2SP[0], STO3G_2SP[1], pos, [0,0,0]))
+        for d in range(3):
+            power = [0,0,0]
+            power[d] = 1
+            out.append(contractedGaussian(zetas[1], STO3G_2SP[0], STO3G_2SP[2], pos, power))
+    return out
+
+def coreHamiltonian(solver, chis):
+    """
+    Overlap and core Hamiltonian (kinetic + nuclear attraction) matrices of the projected basis chis.
+    The kinetic energy is computed as 1/2 <grad chi_a|grad chi_b>, with one derivative per function.
+    """
+    mapper = solver.executor.map
+    S = ortho.overlapMatrix(chis, mapper=mapper)
+    grads = mapper(lambda chi : [solver.D(chi, d) for d in range(3)], chis)
+    Vchis = mapper(lambda chi : solver.Vnuc*chi, chis)
+    n = len(chis)
+    pairs = [(a, b) for a in range(n) for b in range(a, n)]
+    values = mapper(lambda pair : 0.5*sum(vp.dot(grads[pair[0]][d], grads[pair[1]][d]) for d in range(3)) + vp.dot(chis[pair[0]], Vchis[pair[1]]), pairs)
+    H = np.zeros((n, n))
+    for (a, b), value in zip(pairs, values):
+        H[a, b] = value
+        H[b, a] = value
+    return S, H
+
+def coreGuess(solver, Norb = None):
+    """
+    Starting orbitals of the molecule of solver (R, Z and Vnuc must be set): the STO-3G atomic orbitals of every atom
+    are projected in parallel on the executor of the solver, and the core Hamiltonian is diagonalised in their span.
+
+    Args:
+        solver (scfsolv): solver providing the geometry, the operators and the executor
+        Norb (int): number of orbitals, half the number of electrons (rounded up) by default
+
+    Returns:
+        list of vampyr.vampyr3d.FunctionTree: the Norb lowest normalised orbitals
+    """
+    if Norb is None:
+        Norb = (int(sum(solver.Z)) + 1)//2
+    basis = [ao for nuc in range(len(solver.Z)) for ao in atomicOrbitals(solver.Z[nuc], solver.R[nuc])]
+    if Norb > len(basis):
+        raise ValueError(f"{Norb} orbitals requested, but the minimal basis only has {len(basis)} functions")
+    chis = solver.executor.map(solver.P_eps, basis)
+    S, H = coreHamiltonian(solver, chis)
+    #Generalised eigenvalue problem HC = SCe in the Loewdin orthonormalised basis
+    X, U = ortho.lowdinMatrix(S)
+    eigvals, Cprime = np.linalg.eigh(np.dot(X, np.dot(H, X)))
+    C = np.dot(X, Cprime[:, :Norb])
+    orbitals = utils.linComb(np.transpose(C), chis, solver.prec, solver.mra)
+    for phi in orbitals:
+        phi.normalize()
+    return orbitals
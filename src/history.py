@@ -0,0 +1,178 @@
+import os
+import tempfile
+import itertools
+import threading
+from collections import OrderedDict
+from vampyr import vampyr3d as vp
+
+class HistoryStore():
+    """
+    Keeps the trees of the KAIN histories within a RAM budget.
+    Every tree added to a TreeHistory is saved to disk with saveTree when it is evicted, the least recently used resident
+    trees being evicted first when the budget is exceeded. An evicted tree is only reloaded with loadTree when it is accessed.
+    A single store is meant to be shared by all the histories of a solver, so that the budget is global.
+    """
+
+    def __init__(self, mra, budgetMB = 1024., directory = None) -> None:
+        self.mra = mra
+        self.budget = budgetMB*1024.  #in kB, the unit of getSizeNodes
+        self.tmpdir = None
+        if directory is None:
+            self.tmpdir = tempfile.TemporaryDirectory(prefix="scfsolv_history_")
+            directory = self.tmpdir.name
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.resident = OrderedDict()  #key -> (tree, size in kB), least recently used first
+        self.onDisk = set()
+        self.used = 0.
+        self.counter = itertools.count()
+        self.loads = 0
+        self.saves = 0
+        self.lock = threading.RLock()
+
+    def path(self, key):
+        return f"{self.directory}/hist_{key}"
+
+    def add(self, tree):
+        """
+        Registers a tree and returns the key under which it is stored.
+        """
+        with self.lock:
+            key = next(self.counter)
+            self.keep(key, tree)
+            return key
+
+    def keep(self, key, tree):
+        size = tree.getSizeNodes()
+        self.resident[key] = (tree, size)
+        self.used += size
+        self.evict(keep=key)
+
+    def get(self, key):
+        with self.lock:
+            if key in self.resident:
+                self.resident.move_to_end(key)
+                return self.resident[key][0]
+            tree = vp.FunctionTree(self.mra)
+            tree.loadTree(self.path(key))
+            self.loads += 1
+            self.keep(key, tree)
+            return tree
+
+    def evict(self, keep = None):
+        #Spill the least recently used trees until the budget is met, the most recent one always stays in RAM
+        while self.used > self.budget and len(self.resident) > 1:
+            key = next(iter(self.resident))
+            if key == keep:
+                self.resident.move_to_end(key)
+                key = next(iter(self.resident))
+            tree, size = self.resident.pop(key)
+            if key not in self.onDisk:
+                tree.saveTree(self.path(key))
+                self.onDisk.add(key)
+                self.saves += 1
+            self.used -= size
+
+    def remove(self, key):
+        with self.lock:
+            if key in self.resident:
+                self.used -= self.resident.pop(key)[1]
+            if key in self.onDisk:
+                self.onDisk.discard(key)
+                if os.path.exists(self.path(key) + ".tree"):
+                    os.remove(self.path(key) + ".tree")
+
+    def newHistory(self, trees = ()):
+        return TreeHistory(self, trees)
+
+    def refresh(self): #Updates the sizes of the resident trees after they were modified in place, e.g. cropped
+        with self.lock:
+            #The disk copies of the resident trees are outdated, they are written again when evicted
+            for key in self.resident:
+                if key in self.onDisk:
+                    self.onDisk.discard(key)
+                    if os.path.exists(self.path(key) + ".tree"):
+                        os.remove(self.path(key) + ".tree")
+            self.resident = OrderedDict((key, (tree, tree.getSizeNodes())) for key, (tree, size) in self.resident.items())
+            self.used = sum(size for tree, size in self.resident.values())
+            self.evict()
+
+    def stats(self):
+        return {"resident": len(self.resident), "onDisk": len(self.onDisk), "usedMB": self.used/1024., "loads": self.loads, "saves": self.saves}
+
+
+def residentTrees(hist): #Trees of a history that are in RAM, without loading the spilled ones
+    if isinstance(hist, TreeHistory):
+        return [hist.store.resident[key][0] for key in hist.keys if key in hist.store.resident]
+    return list(hist)
+
+
+class TreeHistory():
+    """
+    List-like history of trees backed by a HistoryStore, a drop-in for the lists of phi_prev and f_prev.
+    Supports len, indexing (also negative), item assignment, deletion, append and iteration.
+    """
+
+    def __init__(self, store, trees = ()) -> None:
+        self.store = store
+        self.keys = []
+        for tree in trees:
+            self.append(tree)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.store.get(key) for key in self.keys[index]]
+        return self.store.get(self.keys[index])
+
+    def __setitem__(self, index, tree):
+        old = self.keys[index]
+        self.keys[index] = self.store.add(tree)
+        self.store.remove(old)
+
+    def __delitem__(self, index):
+        self.store.remove(self.keys[index])
+        del self.keys[index]
+
+    def __iter__(self):
+        for key in list(self.keys):
+            yield self.store.get(key)
+
+    def append(self, tree):
+        self.keys.append(self.store.add(tree))
+
+    def entryKeys(self):
+        return list(self.keys)
+
+    def clear(self):
+        for key in self.keys:
+            self.store.remove(key)
+        self.keys = []
+
+    def __del__(self):
+        try:
+            self.clear()
+        except Exception:
+            pass
+
+
+class HistoryColumn():
+    """
+    Read-only view of the n-th tree of every entry of a history indexed [step][orbital], as in the KAIN class.
+    Trees are only loaded when indexed.
+    """
+
+    def __init__(self, histories, n) -> None:
+        self.histories = histories
+        self.n = n
+
+    def __len__(self):
+        return len(self.histories)
+
+    def __getitem__(self, index):
+        return self.histories[index][self.n]
+
+    def entryKeys(self):
+        return [history.entryKeys()[self.n] for history in self.histories]
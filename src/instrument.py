@@ -0,0 +1,175 @@
+import os
+import sys
+import json
+import time
+import threading
+from vampyr import vampyr3d as vp
+import observers
+
+#Modules whose functions are reported as callers of the operators: every module of the solver, except the wrappers of this one
+SOLVER_FILES = frozenset(name for name in os.listdir(os.path.dirname(os.path.abspath(__file__)))
+                         if name.endswith(".py") and name != os.path.basename(__file__))
+
+#Instrumented entry points: label -> (owner, attribute). The operators are patched at class level so that every instance
+#is covered, including the Helmholtz operators created during the run and the operators of copied solvers.
+TARGETS = {
+    "P_eps": (vp.ScalingProjector, "__call__"),
+    "Pois": (vp.PoissonOperator, "__call__"),
+    "D": (vp.ABGVDerivative, "__call__"),
+    "G_mu": (vp.HelmholtzOperator, "__call__"),
+    "dot": (vp, "dot"),
+    "advanced.add": (vp.advanced, "add"),
+    "tree+": (vp.FunctionTree, "__add__"),
+    "tree-": (vp.FunctionTree, "__sub__"),
+    "tree*": (vp.FunctionTree, "__mul__"),
+    "*tree": (vp.FunctionTree, "__rmul__"),
+    "tree/": (vp.FunctionTree, "__truediv__"),
+    "-tree": (vp.FunctionTree, "__neg__"),
+}
+
+class Instrumentation(observers.ScfObserver):
+    """
+    Counts the calls of the vp operators, their cumulative wall time and the node counts and sizes (kB) of the trees going
+    in and out, grouped by the solver method calling them.
+    Nothing is patched until enable is called, and disable restores the original functions, so a disabled instrumentation
+    costs nothing. As an observer it closes a report at every iteration. The reports can be dumped as JSON (toJSON) or as
+    collapsed stacks for flame graph tools (toCollapsed), the stacks being made of the solver methods down to the operator.
+    Only one instrumentation can be enabled at a time since the patches are global.
+    """
+
+    events = ("iteration", "finish")
+    enabled = None  #the enabled instrumentation, if any
+
+    def __init__(self) -> None:
+        self.originals = {}
+        self.unpatched = []  #targets that could not be patched
+        self.solvers = []
+        self.reports = []
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.methods = {}    #caller -> label -> counters
+        self.collapsed = {}  #"caller;...;label" -> time in s
+
+    def enable(self, solver = None): #solver gets the instrumentation as an observer to receive per-iteration reports
+        if Instrumentation.enabled is not None:
+            raise RuntimeError("Another instrumentation is already enabled")
+        for label, (owner, name) in TARGETS.items():
+            func = getattr(owner, name, None)
+            if func is None:
+                continue
+            try:
+                setattr(owner, name, self.wrap(label, func))
+                self.originals[label] = func
+            except (TypeError, AttributeError):
+                self.unpatched.append(label)
+        Instrumentation.enabled = self
+        if solver is not None:
+            solver.addObserver(self)
+            self.solvers.append(solver)
+        return self
+
+    def disable(self):
+        for label, func in self.originals.items():
+            owner, name = TARGETS[label]
+            setattr(owner, name, func)
+        self.originals = {}
+        for solver in self.solvers:
+            solver.removeObserver(self)
+        self.solvers = []
+        if Instrumentation.enabled is self:
+            Instrumentation.enabled = None
+
+    def __enter__(self):
+        return self if Instrumentation.enabled is self else self.enable()
+
+    def __exit__(self, *exc):
+        self.disable()
+
+    def wrap(self, label, func):
+        instr = self
+        def wrapper(*args, **kwargs):
+            #Nested instrumented calls are part of the outer one
+            if getattr(instr.local, "active", False):
+                return func(*args, **kwargs)
+            instr.local.active = True
+            try:
+                start = time.perf_counter()
+                out = func(*args, **kwargs)
+                elapsed = time.perf_counter() - start
+                instr.record(label, elapsed, args, out)
+            finally:
+                instr.local.active = False
+            return out
+        return wrapper
+
+    def callerStack(self): #Names of the solver functions on the stack, outermost first
+        stack = []
+        frame = sys._getframe(3)
+        while frame is not None:
+            if os.path.basename(frame.f_code.co_filename) in SOLVER_FILES:
+                stack.append(frame.f_code.co_name)
+            frame = frame.f_back
+        stack.reverse()
+        return stack
+
+    def record(self, label, elapsed, args, out):
+        stack = self.callerStack()
+        caller = stack[-1] if len(stack) > 0 else "<toplevel>"
+        nodesIn, sizeIn = treeSizes(args)
+        nodesOut, sizeOut = treeSizes((out,))
+        with self.lock:
+            counters = self.methods.setdefault(caller, {}).setdefault(label, {"calls": 0, "time": 0., "nodesIn": 0, "sizeIn": 0., "nodesOut": 0, "sizeOut": 0.})
+            counters["calls"] += 1
+            counters["time"] += elapsed
+            counters["nodesIn"] += nodesIn
+            counters["sizeIn"] += sizeIn
+            counters["nodesOut"] += nodesOut
+            counters["sizeOut"] += sizeOut
+            key = ";".join(stack + [label])
+            self.collapsed[key] = self.collapsed.get(key, 0.) + elapsed
+
+    def report(self, iteration = None, solver = None, elapsed = None): #Closes the current report and starts a new one
+        with self.lock:
+            rep = {"iteration": iteration, "solver": None if solver is None else type(solver).__name__, "time": elapsed,
+                   "methods": self.methods, "collapsed": self.collapsed}
+            self.reset()
+        self.reports.append(rep)
+        return rep
+
+    def notify(self, event, solver, data):
+        if event == "iteration":
+            self.report(data["iteration"], solver, data["time"])
+        elif event == "finish" and len(self.methods) > 0:
+            #Work done after the last iteration
+            self.report("finish", solver)
+
+    def toJSON(self, path):
+        with open(path, "w") as f:
+            json.dump({"unpatched": self.unpatched, "reports": self.reports}, f, indent=2)
+
+    def toCollapsed(self, path, iterations = None):
+        """
+        Writes the collapsed stacks "caller;...;operator microseconds", one per line, summed over the reports of the
+        given iterations (all by default). The file can be fed to flamegraph.pl or speedscope.
+        """
+        total = {}
+        for rep in self.reports:
+            if iterations is None or rep["iteration"] in iterations:
+                for key, value in rep["collapsed"].items():
+                    total[key] = total.get(key, 0.) + value
+        with open(path, "w") as f:
+            for key, value in sorted(total.items()):
+                f.write(f"{key} {int(round(value*1e6))}\n")
+
+
+def treeSizes(objects): #Total number of nodes and size in kB of the FunctionTrees among objects
+    nodes = 0
+    size = 0.
+    for obj in objects:
+        if isinstance(obj, vp.FunctionTree):
+            nodes += obj.getNNodes()
+            size += obj.getSizeNodes()
+    return nodes, size
@@ -1,6 +1,5 @@
 from vampyr import vampyr3d as vp
 import numpy as np
-import matplotlib.pyplot as plt
 # from copy import deepcopy
 
 # import KAIN
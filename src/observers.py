@@ -0,0 +1,81 @@
+import numpy as np
+
+class ScfObserver():
+    """
+    Receives the events of the SCF loops. The base class is the headless default: it wants no event,
+    so the solver does not even build the payloads.
+    Events and payload keys:
+    - "iteration": iteration, energies, norms (None for the response), updates, time (wall time of the iteration in s)
+    - "finish": iterations
+    - "overlap": S
+    - "transform": U
+    - "diagnostic": name, value (debugging quantities, e.g. orthogonality tests, only computed when wanted)
+    - "memory": nodes (node counts by group and total), cropFactor
+    - "screening": pairs, skipped (exchange pairs considered and skipped by one exchange build)
+    """
+
+    events = ()
+
+    def wants(self, event):
+        return event in self.events
+
+    def notify(self, event, solver, data):
+        pass
+
+
+class PrintObserver(ScfObserver):
+    """
+    Prints the iteration summaries, and with verbose also the overlap, transform and diagnostic events.
+    """
+
+    def __init__(self, verbose = False) -> None:
+        self.events = ("iteration", "finish", "overlap", "transform", "diagnostic", "memory", "screening") if verbose else ("iteration", "finish")
+
+    def notify(self, event, solver, data):
+        if event == "iteration":
+            print(f"=============Iteration: {data['iteration']}")
+            print(f"Norm: {data['norms']}    Update: {data['updates']}    Energy:{data['energies']}    Time: {data['time']:.2f}s")
+        elif event == "finish":
+            print(f"=============Converged after {data['iterations']} iterations")
+        elif event == "overlap":
+            print(data["S"])
+        elif event == "transform":
+            print("U=", data["U"])
+        elif event == "diagnostic":
+            print(data["name"], data["value"])
+        elif event == "memory":
+            print(f"Nodes: {data['nodes']}    Crop factor: {data['cropFactor']}")
+        elif event == "screening":
+            print(f"Exchange pairs skipped: {data['skipped']}/{data['pairs']}")
+
+
+class PlotObserver(ScfObserver):
+    """
+    Plots every orbital along the x axis after each iteration and shows the figure at the end of the run.
+    matplotlib is only imported when this observer is created.
+    """
+
+    events = ("iteration", "finish")
+
+    def __init__(self, xmin = -5., xmax = 5., npoints = 1000, show = True) -> None:
+        import matplotlib.pyplot as plt
+        self.plt = plt
+        self.r_x = np.linspace(xmin, xmax, npoints)
+        self.show = show
+
+    def notify(self, event, solver, data):
+        if event == "iteration":
+            for orb in range(solver.Norb):
+                phi_n_plt = [solver.phi_prev[orb][-1]([x, 0.0, 0.0]) for x in self.r_x]
+                self.plt.plot(self.r_x, phi_n_plt)
+        elif event == "finish" and self.show:
+            self.plt.show()
+
+
+def fromFlags(printVal = False, pltShow = False): #Observers matching the legacy printVal/pltShow arguments of scfRun
+    out = []
+    if printVal:
+        out.append(PrintObserver())
+    if pltShow:
+        out.append(PlotObserver())
+    return out
@@ -0,0 +1,117 @@
+import threading
+import time
+from collections import OrderedDict
+from vampyr import vampyr3d as vp
+
+class IterationCache():
+    """
+    Memoizes operator applications (J, K_i, F phi_i, Fock matrices...) for as long as the orbitals they were computed from do not change.
+    Every entry is stored together with the orbital version it was computed for. A lookup with another version is a miss,
+    and the outdated entry is dropped so that its trees can be freed.
+    """
+
+    def __init__(self) -> None:
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, version):
+        """
+        Args:
+            key (hashable): name of the cached quantity, e.g. "fock" or ("Fphi", orb)
+            version (hashable): version of the orbitals the caller is working with
+
+        Returns:
+            the cached value, or None if it is missing or outdated
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] == version:
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self.entries[key]
+            self.misses += 1
+            return None
+
+    def store(self, key, version, value):
+        with self.lock:
+            self.entries[key] = (version, value)
+        return value
+
+    def lookup(self, key, version, builder):
+        """
+        Returns the cached value of key for this version, calling builder() and storing its result on a miss.
+        """
+        value = self.get(key, version)
+        if value is None:
+            value = self.store(key, version, builder())
+        return value
+
+    def clear(self):
+        with self.lock:
+            self.entries = {}
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self.entries)}
+
+
+class HelmholtzCache():
+    """
+    LRU cache of Helmholtz operators keyed by (MRA, precision, quantized mu).
+    mu is rounded to a multiple of muTol and the operator is built with the rounded value, so the operator used for a
+    given energy does not depend on the order of the lookups. The rounded operator solves the equation of another
+    energy: the solvers add (mu^2 - mu_q^2)/2 times the orbital to the Helmholtz argument (scfsolv.helmholtzShift) so
+    that the fixed point is the one of the exact mu.
+    """
+
+    def __init__(self, muTol = 1.0e-3, maxSize = 32) -> None:
+        self.muTol = muTol
+        self.maxSize = maxSize
+        self.operators = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.buildTime = 0.0  #time spent building operators
+        self.savedTime = 0.0  #build time avoided by cache hits
+        self.lock = threading.Lock()
+
+    def quantize(self, mu):
+        return round(mu/self.muTol)*self.muTol
+
+    def get(self, mra, mu, prec):
+        """
+        Args:
+            mra (vampyr.vampyr3d.MultiResolutionAnalysis): MRA of the operator
+            mu (float): Helmholtz exponent, sqrt(-2*E)
+            prec (float): precision of the operator
+
+        Returns:
+            vampyr.vampyr3d.HelmholtzOperator: cached or newly built operator for the quantized mu
+        """
+        key = (id(mra), prec, round(mu/self.muTol))
+        with self.lock:
+            entry = self.operators.get(key)
+            if entry is not None:
+                self.operators.move_to_end(key)
+                self.hits += 1
+                self.savedTime += entry[2]
+                return entry[1]
+        start = time.perf_counter()
+        operator = vp.HelmholtzOperator(mra, self.quantize(mu), prec)
+        elapsed = time.perf_counter() - start
+        with self.lock:
+            self.misses += 1
+            self.buildTime += elapsed
+            #The MRA is kept in the entry so that its id cannot be reused while the key exists
+            self.operators[key] = (mra, operator, elapsed)
+            while len(self.operators) > self.maxSize:
+                self.operators.popitem(last=False)
+        return operator
+
+    def clear(self):
+        with self.lock:
+            self.operators = OrderedDict()
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "size": len(self.operators), "buildTime": self.buildTime, "savedTime": self.savedTime}
@@ -0,0 +1,48 @@
+import numpy as np
+from vampyr import vampyr3d as vp
+
+#Orthonormalisation of lists of orbitals: overlap matrices and the transformation matrices applied with utils.linComb
+
+def overlapMatrix(bra, ket = None, mapper = map):
+    """
+    Computes S[i, j] = <bra_i|ket_j>. Without ket, S is the symmetric overlap of bra and only its upper triangle is computed.
+
+    Args:
+        bra (list of vampyr.vampyr3d.FunctionTree): bra functions
+        ket (list of vampyr.vampyr3d.FunctionTree): ket functions, defaults to bra
+        mapper (callable): map-like function used to run the dot products, e.g. OrbitalExecutor.map
+
+    Returns:
+        np.ndarray: overlap matrix
+    """
+    if ket is None:
+        pairs = [(i, j) for i in range(len(bra)) for j in range(i, len(bra))]
+        values = list(mapper(lambda pair : vp.dot(bra[pair[0]], bra[pair[1]]), pairs))
+        S = np.zeros((len(bra), len(bra)))
+        for (i, j), value in zip(pairs, values):
+            S[i, j] = value
+            S[j, i] = np.conjugate(value)
+        return S
+    pairs = [(i, j) for i in range(len(bra)) for j in range(len(ket))]
+    values = list(mapper(lambda pair : vp.dot(bra[pair[0]], ket[pair[1]]), pairs))
+    return np.array(values).reshape((len(bra), len(ket)))
+
+def isOrthonormal(S, tol):
+    return np.max(np.abs(S - np.eye(S.shape[0]))) <= tol
+
+def lowdinMatrix(S):
+    """
+    Symmetric (Loewdin) orthonormalisation: returns S^-1/2 and the eigenvectors U of S.
+    """
+    eigvals, U = np.linalg.eigh(S) #U is the basis change matrix
+    s = np.diag(np.power(eigvals, -0.5)) #diagonalised S^-1/2
+    return np.dot(U, np.dot(s, np.transpose(U))), U # S^-1/2 = U s^-1/2 U^dagger
+
+def choleskyMatrix(S):
+    """
+    Gram-Schmidt orthonormalisation through the Cholesky factorisation S = L L^dagger: returns L^-1.
+    L^-1 is lower triangular, so orbital i only combines orbitals j <= i and half of the tree operations are skipped.
+    """
+    L = np.linalg.cholesky(S)
+    #The general solver leaves rounding noise above the diagonal, the zeros must be exact for the terms to be skipped
+    return np.tril(np.linalg.solve(L, np.eye(S.shape[0])))
@@ -0,0 +1,170 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import numpy as np
+from vampyr import vampyr3d as vp
+import opcache
+import treefiles
+
+class OrbitalExecutor():
+    """
+    Runs independent per-orbital tasks of an SCF iteration on a configurable worker pool.
+    - "serial": plain loop, the reference behaviour.
+    - "thread": per-orbital tasks run on a thread pool. This only pays off if the vampyr operators release the GIL.
+    - "process": the Helmholtz applications and the exchange pair potentials run on a process pool, the trees go through
+      a treefiles.TreeFileStore. The other per-orbital tasks run serially in the main process.
+    Results are always collected in orbital order and every task only touches its own orbital, so all modes give
+    the same results as the serial loop.
+    A map called from inside a pool task runs inline: the outer tasks may hold every worker, so waiting for nested tasks
+    queued on the same pool would deadlock.
+    """
+
+    modes = ("serial", "thread", "process")
+
+    def __init__(self, mode = "serial", workers = None) -> None:
+        if mode not in self.modes:
+            raise ValueError(f"Unknown execution mode {mode}, expected one of {self.modes}")
+        self.mode = mode
+        self.workers = workers if workers is not None else os.cpu_count()
+        self.pool = None
+        self.transport = None
+
+    def getPool(self):
+        if self.pool is None:
+            if self.mode == "thread":
+                self.pool = ThreadPoolExecutor(max_workers=self.workers)
+            elif self.mode == "process":
+                self.pool = ProcessPoolExecutor(max_workers=self.workers)
+        return self.pool
+
+    def getTransport(self):
+        if self.transport is None:
+            self.transport = treefiles.TreeFileStore()
+        return self.transport
+
+    def map(self, func, items):
+        """
+        Applies func to every item in the current process and returns the results in the order of items.
+        """
+        items = list(items)
+        if self.mode != "thread" or len(items) < 2 or inPoolTask():
+            return [func(item) for item in items]
+        return list(self.getPool().map(lambda item : runPoolTask(func, item), items))
+
+    def applyHelmholtz(self, mra, mraParams, prec, G_mu, mus, trees):
+        """
+        Computes -2*G_mu[i](trees[i]) for every i.
+
+        Args:
+            mra (vampyr.vampyr3d.MultiResolutionAnalysis): MRA of the trees
+            mraParams (dict): parameters of the MRA, used by the worker processes to rebuild it
+            prec (float): precision of the Helmholtz operators
+            G_mu (list): Helmholtz operators of the main process, used outside of process mode
+            mus (list): Helmholtz exponents, already quantized, used by the worker processes to rebuild the operators
+            trees (list of vampyr.vampyr3d.FunctionTree): right hand sides
+
+        Returns:
+            list of vampyr.vampyr3d.FunctionTree: results in the order of trees
+        """
+        if self.mode != "process":
+            return self.map(lambda i : -2*G_mu[i](trees[i]), range(len(trees)))
+        transport = self.getTransport()
+        try:
+            futures = []
+            outputs = []
+            for i in range(len(trees)):
+                outputs.append(transport.output())
+                futures.append(self.getPool().submit(helmholtzWorker, mraParams, prec, mus[i], transport.publish(trees[i]), outputs[i]))
+            out = []
+            for i in range(len(trees)):
+                futures[i].result()
+                out.append(transport.fetch(outputs[i], mra))
+        finally:
+            transport.release()
+        return out
+
+    def applyPairPotentials(self, mra, mraParams, prec, phis, pairs):
+        """
+        Computes the pair potentials P[phi_i*phi_j] of the given pairs on the process pool. Every orbital is published
+        once, whatever the number of pairs it is part of.
+
+        Args:
+            mra (vampyr.vampyr3d.MultiResolutionAnalysis): MRA of the trees
+            mraParams (dict): parameters of the MRA, used by the worker processes to rebuild it
+            prec (float): precision of the Poisson operator
+            phis (list of vampyr.vampyr3d.FunctionTree): orbitals
+            pairs (list of tuple): orbital index pairs (i, j)
+
+        Returns:
+            list of vampyr.vampyr3d.FunctionTree: pair potentials in the order of pairs
+        """
+        transport = self.getTransport()
+        try:
+            handles = [transport.publish(phi) for phi in phis]
+            futures = []
+            outputs = []
+            for i, j in pairs:
+                outputs.append(transport.output())
+                futures.append(self.getPool().submit(pairPotentialWorker, mraParams, prec, handles[i], handles[j], outputs[-1]))
+            out = []
+            for future, output in zip(futures, outputs):
+                future.result()
+                out.append(transport.fetch(output, mra))
+        finally:
+            transport.release()
+        return out
+
+    def shutdown(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+        if self.transport is not None:
+            self.transport.close()
+            self.transport = None
+
+
+#Marks the threads currently running a pool task
+taskState = threading.local()
+
+def inPoolTask():
+    return getattr(taskState, "active", False)
+
+def runPoolTask(func, item):
+    taskState.active = True
+    try:
+        return func(item)
+    finally:
+        taskState.active = False
+
+
+#Worker side of the process mode. Each worker process builds its own MRA once and keeps its own Helmholtz and Poisson operators.
+workerMRA = {}
+workerHelmholtz = opcache.HelmholtzCache()
+workerPoisson = {}
+
+def buildMRA(mraParams):
+    world = vp.BoundingBox(corner=[-1]*3, nboxes=[mraParams["nboxes"]]*3, scaling=[mraParams["scling"]]*3, scale=mraParams["sizeScale"])
+    return vp.MultiResolutionAnalysis(order=mraParams["lgdrOrder"], box=world)
+
+def workerMra(mraParams):
+    key = tuple(sorted(mraParams.items()))
+    if key not in workerMRA:
+        workerMRA[key] = buildMRA(mraParams)
+    return workerMRA[key]
+
+def helmholtzWorker(mraParams, prec, mu, inHandle, outHandle):
+    mra = workerMra(mraParams)
+    tree = inHandle.load(mra)
+    out = -2*workerHelmholtz.get(mra, mu, prec)(tree)
+    out.saveTree(outHandle.path)
+
+def pairPotentialWorker(mraParams, prec, handle_i, handle_j, outHandle):
+    mra = workerMra(mraParams)
+    key = (tuple(sorted(mraParams.items())), prec)
+    if key not in workerPoisson:
+        workerPoisson[key] = vp.PoissonOperator(mra, prec)
+    #A worker loads each orbital once for all its pairs
+    phi_i = treefiles.loadCached(handle_i, mra)
+    phi_j = treefiles.loadCached(handle_j, mra)
+    out = workerPoisson[key](4*np.pi*phi_i*phi_j)
+    out.saveTree(outHandle.path)
@@ -0,0 +1,90 @@
+import threading
+import numpy as np
+from vampyr import vampyr3d as vp
+import utils
+
+#Dipole properties. The position trees r_i are projected once per MRA and precision and shared by every solver using
+#them (ground state, response directions, frequencies, geometries of a scan). The nuclear dipole Sum_a Z_a R_a is a
+#constant, computed analytically: as an operator it only shifts the energies, the response does not depend on it.
+#The cached trees must not be modified in place.
+
+positionCache = {}  #(id(mra), prec) -> (mra, position trees, dipole operator trees), the mra is kept so that its id is not reused
+cacheLock = threading.Lock()
+
+def cachedTrees(solver):
+    key = (id(solver.mra), solver.prec)
+    with cacheLock:
+        entry = positionCache.get(key)
+        if entry is None:
+            positions = [solver.P_eps(utils.FlinGetter(drct)) for drct in range(3)]
+            #Dipole operator of an electron, of charge -1
+            entry = (solver.mra, positions, [-1*r for r in positions])
+            positionCache[key] = entry
+    return entry
+
+def positionTrees(solver): #x, y and z projected on the MRA of solver at its working precision
+    return cachedTrees(solver)[1]
+
+def dipoleOperators(solver): #-x, -y and -z, the dipole operators acting on the electrons
+    return cachedTrees(solver)[2]
+
+def clearCache():
+    with cacheLock:
+        positionCache.clear()
+
+def nuclearDipole(R, Z):
+    """
+    Returns:
+        np.ndarray: Sum_a Z_a R_a
+    """
+    if len(Z) == 0:
+        return np.zeros(3)
+    return np.dot(np.array(Z, dtype=float), np.array(R, dtype=float))
+
+def electronicDipole(solver, orbitals = None, occupation = 2.):
+    """
+    mu_i = -occupation Sum_k <phi_k|r_i|phi_k>, with one density phi_k^2 per orbital dotted with the three cached position trees.
+
+    Args:
+        solver (scfsolv): solver providing the MRA, the precision and the executor
+        orbitals (list of vampyr.vampyr3d.FunctionTree): the current orbitals of solver by default
+    """
+    if orbitals is None:
+        orbitals = [solver.phi_prev[k][-1] for k in range(solver.Norb)]
+    r = positionTrees(solver)
+    values = solver.executor.map(lambda phi : densityMoments(r, phi*phi), orbitals)
+    return -occupation*np.sum(np.array(values).reshape(-1, 3), axis=0)
+
+def densityMoments(r, rho): #<rho|r_i> for the three directions
+    return [vp.dot(r[drct], rho) for drct in range(3)]
+
+def dipoleMoment(solver, orbitals = None):
+    """
+    Returns:
+        tuple: total, electronic and nuclear dipole moments, as arrays of 3 components
+    """
+    electronic = electronicDipole(solver, orbitals)
+    nuclear = nuclearDipole(solver.R, solver.Z)
+    return electronic + nuclear, electronic, nuclear
+
+def dipoleOrbitals(ground, dipoles): #mu_i*phi_k for every direction i and unperturbed orbital k
+    phi = [ground.phi_prev[k][-1] for k in range(ground.Norb)]
+    return ground.executor.map(lambda dipole : [dipole*phi[k] for k in range(ground.Norb)], dipoles)
+
+def responseContraction(ground, muPhi, responses, factor = -4.):
+    """
+    alpha_ij = factor Sum_k <mu_i phi_k|phi^1_k(j)>, all the (i, j, k) inner products batched on the executor of ground.
+
+    Args:
+        muPhi (list): mu_i*phi_k, see dipoleOrbitals
+        responses (dict): column j -> perturbed orbitals phi^1_k(j)
+
+    Returns:
+        np.ndarray: 3 x 3 tensor, only the columns in responses are set
+    """
+    terms = [(i, j, k) for j in responses for i in range(len(muPhi)) for k in range(ground.Norb)]
+    values = ground.executor.map(lambda term : vp.dot(muPhi[term[0]][term[2]], responses[term[1]][term[2]]), terms)
+    alpha = np.zeros((3, 3))
+    for (i, j, k), value in zip(terms, values):
+        alpha[i, j] += factor*value
+    return alpha
@@ -0,0 +1,217 @@
+import time
+import numpy as np
+from scfsolv import scfsolv_1stpert, scfsolv_dynpert
+import properties
+from properties import dipoleOrbitals
+
+class PolarizabilitySolver():
+    """
+    Solves the x, y and z first order responses of a converged scfsolv together and returns the polarizability tensor.
+    One scfsolv_1stpert is created per direction from the same ground state, so the unperturbed Vnuc, J, K, Fock and
+    G_mu are shared. On top of that:
+    - the dipole operators are the cached ones of properties, both the perturbations and the property operators;
+    - the unperturbed pair potentials P[phi_i*phi_j] are computed once, in a pair cache shared by the three directions;
+    - the Fock builds of the directions run together on the executor of the ground state, and the Helmholtz
+      applications of every direction and orbital are sent to the executor as a single batch.
+    The directions are iterated in lockstep. A converged direction stops iterating while the others go on.
+    """
+
+    def __init__(self, ground) -> None:
+        self.ground = ground
+        self.executor = ground.executor
+        self.solvers = [scfsolv_1stpert(ground) for drct in range(3)]
+        #Shared unperturbed pair potentials
+        for solver in self.solvers[1:]:
+            solver.pairCache = self.solvers[0].pairCache
+        self.dipoles = []
+        self.alpha = np.zeros((3, 3))
+
+    def init_molec(self):
+        self.dipoles = properties.dipoleOperators(self.ground)
+        #The pair potentials only depend on the unperturbed orbitals, they are computed once before the directions start
+        Norb = self.ground.Norb
+        pairs = [(i, j) for i in range(Norb) for j in range(i, Norb)]
+        self.executor.map(lambda pair : self.solvers[0].unperturbedPairPotential(*pair), pairs)
+        for drct in range(3):
+            field = np.zeros(3)
+            field[drct] = 1.
+            self.solvers[drct].init_molec(field, self.dipoles[drct])
+
+    def expandSolution(self, active): #One lockstep iteration of the directions in active
+        solvers = [self.solvers[drct] for drct in active]
+        self.executor.map(lambda solver : solver.prepareStep(), solvers)
+        Norb = self.ground.Norb
+        arguments = [solver.helmholtzArgument(orb) for solver in solvers for orb in range(Norb)]
+        #The unperturbed Helmholtz operators are the same for every direction
+        mus = [self.ground.helmholtz.quantize(np.sqrt(-2*E)) for E in self.ground.E_n]
+        phi_np1 = self.executor.applyHelmholtz(self.ground.mra, self.ground.mraParams, self.ground.prec, self.ground.G_mu*len(solvers), mus*len(solvers), arguments)
+        out = []
+        for k in range(len(solvers)):
+            out.append(solvers[k].completeStep(phi_np1[k*Norb:(k+1)*Norb]))
+        return out
+
+    def scfRun(self, thrs = 1e-3, maxIter = 10):
+        """
+        Iterates the three responses until every update is below thrs, or maxIter iterations.
+
+        Returns:
+            np.ndarray: 3x3 polarizability tensor
+        """
+        updates = [np.ones(self.ground.Norb) for drct in range(3)]
+        iteration = 1
+        while iteration < maxIter:
+            active = [drct for drct in range(3) if updates[drct].max() > thrs]
+            if len(active) == 0:
+                break
+            start = time.perf_counter()
+            for drct, (E1_n, update) in zip(active, self.expandSolution(active)):
+                self.solvers[drct].E1_n = E1_n
+                updates[drct] = update
+                self.solvers[drct].manageMemory()
+                self.solvers[drct].iteration += 1
+            elapsed = time.perf_counter() - start
+            self.ground.emit("iteration", lambda : {"iteration": iteration, "energies": np.array([solver.E1_n for solver in self.solvers]),
+                                                    "norms": None, "updates": np.array(updates), "time": elapsed})
+            iteration += 1
+        self.ground.emit("finish", lambda : {"iterations": iteration - 1})
+        return self.polarizability()
+
+    def polarizability(self):
+        """
+        alpha_ij = -4 Sum_k <phi_k|mu_i|phi^1_k(j)>, with phi^1(j) the response to the dipole operator mu_j.
+        The factor 4 is 2 for the doubly occupied orbitals times 2 for the two first order terms of the density.
+        """
+        Norb = self.ground.Norb
+        muPhi = dipoleOrbitals(self.ground, self.dipoles)
+        responses = {j: [self.solvers[j].phi_prev1[k][-1] for k in range(Norb)] for j in range(3)}
+        self.alpha = properties.responseContraction(self.ground, muPhi, responses)
+        return self.alpha
+
+
+class DynamicResponse():
+    """
+    Response to an oscillating field along drct at frequency omega: the x (+omega) and y (-omega) scfsolv_dynpert
+    components, iterated in lockstep with their Helmholtz applications batched on the executor of the ground state.
+    """
+
+    def __init__(self, ground, drct, omega, dipole, pairCache = None) -> None:
+        self.ground = ground
+        self.executor = ground.executor
+        self.drct = drct
+        self.omega = omega
+        self.dipole = dipole
+        self.components = [scfsolv_dynpert(ground, omega), scfsolv_dynpert(ground, -omega)]
+        self.components[0].partner = self.components[1]
+        self.components[1].partner = self.components[0]
+        if pairCache is not None:
+            for comp in self.components:
+                comp.pairCache = pairCache
+
+    def init_molec(self, guess = None): #guess is a pair (x, y) of lists of trees, e.g. the orbitals of another frequency
+        field = np.zeros(3)
+        field[self.drct] = 1.
+        for k in range(2):
+            self.components[k].init_molec(field, self.dipole, None if guess is None else guess[k])
+
+    def expandSolution(self):
+        Norb = self.ground.Norb
+        for comp in self.components:
+            comp.prepareStep()
+        arguments = [comp.helmholtzArgument(orb) for comp in self.components for orb in range(Norb)]
+        G_mu = [G for comp in self.components for G in comp.G_mu]
+        mus = [self.ground.helmholtz.quantize(np.sqrt(-2*comp.helmholtzEnergy(orb))) for comp in self.components for orb in range(Norb)]
+        phi_np1 = self.executor.applyHelmholtz(self.ground.mra, self.ground.mraParams, self.ground.prec, G_mu, mus, arguments)
+        return [self.components[k].completeStep(phi_np1[k*Norb:(k+1)*Norb]) for k in range(2)]
+
+    def scfRun(self, thrs = 1e-3, maxIter = 10): #Returns the number of iterations
+        update = np.ones(2*self.ground.Norb)
+        iteration = 1
+        while update.max() > thrs and iteration < maxIter:
+            start = time.perf_counter()
+            steps = self.expandSolution()
+            for comp, (E1_n, upd) in zip(self.components, steps):
+                comp.E1_n = E1_n
+                comp.manageMemory()
+                comp.iteration += 1
+            update = np.concatenate([upd for E1_n, upd in steps])
+            elapsed = time.perf_counter() - start
+            self.ground.emit("iteration", lambda : {"iteration": iteration, "energies": np.array([comp.E1_n for comp in self.components]),
+                                                    "norms": None, "updates": update, "time": elapsed})
+            iteration += 1
+        self.ground.emit("finish", lambda : {"iterations": iteration - 1})
+        return iteration - 1
+
+    def orbitals(self): #Current (x, y) perturbed orbitals
+        return tuple([comp.phi_prev1[orb][-1] for orb in range(self.ground.Norb)] for comp in self.components)
+
+    def polarizability(self, muPhi):
+        """
+        Column drct of the dynamic polarizability, alpha_i,drct(omega) = -2 Sum_k <phi_k|mu_i|x_k + y_k>.
+
+        Args:
+            muPhi (list): mu_i*phi_k, see dipoleOrbitals
+        """
+        x, y = self.orbitals()
+        alpha = properties.responseContraction(self.ground, muPhi, {self.drct: x}, -2.) + properties.responseContraction(self.ground, muPhi, {self.drct: y}, -2.)
+        return alpha[:len(muPhi), self.drct]
+
+
+class FrequencySweep():
+    """
+    Dynamic polarizabilities of a converged scfsolv at a list of frequencies.
+    Each frequency starts from the converged orbitals of the nearest frequency already solved, so that only the first
+    one starts from zero. The dipole operators and the unperturbed pair potentials are computed once for the whole sweep,
+    and the shifted Helmholtz operators come from the Helmholtz cache of the ground state: the three directions of a
+    frequency share them, and so do frequencies whose shifted energies fall within the cache tolerance.
+    """
+
+    def __init__(self, ground, directions = (0, 1, 2)) -> None:
+        self.ground = ground
+        self.directions = list(directions)
+        self.pairCache = None
+        self.dipoles = []
+        self.muPhi = []
+        self.solutions = {}   #omega -> {drct: (x, y)} converged orbitals
+        self.alpha = {}       #omega -> 3x3 polarizability, only the columns of the swept directions are set
+        self.iterations = {}  #omega -> {drct: iterations}
+
+    def init_molec(self):
+        proto = scfsolv_1stpert(self.ground)
+        self.pairCache = proto.pairCache
+        self.dipoles = properties.dipoleOperators(self.ground)
+        Norb = self.ground.Norb
+        pairs = [(i, j) for i in range(Norb) for j in range(i, Norb)]
+        self.ground.executor.map(lambda pair : proto.unperturbedPairPotential(*pair), pairs)
+        self.muPhi = dipoleOrbitals(self.ground, self.dipoles)
+
+    def nearestSolved(self, omega):
+        if len(self.solutions) == 0:
+            return None
+        return min(self.solutions, key=lambda solved : abs(solved - omega))
+
+    def solve(self, omega, thrs = 1e-3, maxIter = 10):
+        nearest = self.nearestSolved(omega)
+        self.alpha[omega] = np.zeros((3, 3))
+        self.iterations[omega] = {}
+        self.solutions[omega] = {}
+        for drct in self.directions:
+            resp = DynamicResponse(self.ground, drct, omega, self.dipoles[drct], self.pairCache)
+            resp.init_molec(None if nearest is None else self.solutions[nearest][drct])
+            self.iterations[omega][drct] = resp.scfRun(thrs, maxIter)
+            self.alpha[omega][:, drct] = resp.polarizability(self.muPhi)
+            self.solutions[omega][drct] = resp.orbitals()
+        return self.alpha[omega]
+
+    def run(self, omegas, thrs = 1e-3, maxIter = 10):
+        """
+        Solves every frequency of omegas, in increasing order so that the warm starts come from close frequencies.
+
+        Returns:
+            dict: omega -> 3x3 polarizability
+        """
+        if len(self.dipoles) == 0:
+            self.init_molec()
+        for omega in sorted(omegas):
+            if omega not in self.alpha:
+                self.solve(omega, thrs, maxIter)
+        return {omega: self.alpha[omega] for omega in omegas}
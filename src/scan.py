@@ -0,0 +1,124 @@
+import sys
+import json
+import time
+import argparse
+import numpy as np
+from scfsolv import scfsolv
+from response import PolarizabilitySolver
+
+#Geometry scans (potential energy curves): one solver runs every geometry in order, so the projector, Poisson and
+#derivative operators are built once and the Helmholtz cache is shared by the whole scan. Each geometry starts from the
+#converged orbitals of the previous one, only the first one starts from the core guess (or from given orbitals).
+
+class GeometryScan():
+    """
+    Runs a converged SCF, and optionally the static polarizability, at every geometry of a list.
+    Geometries are pairs (R, Z). The orbitals of the previous geometry are only reused if the number of orbitals is the
+    same, otherwise the geometry starts from the core guess.
+    Every finished geometry is written as a line of a tab-separated table, flushed right away, so that a long scan can be
+    followed, and its results kept if it is interrupted.
+    """
+
+    def __init__(self, solver, response = False, responseIter = 10) -> None:
+        self.solver = solver
+        self.response = response
+        self.responseIter = responseIter
+        self.results = []
+
+    def runGeometry(self, R, Z, thrs, orbitals = None, Norb = None):
+        solver = self.solver
+        start = time.perf_counter()
+        if orbitals is None and solver.Norb == Norb and len(solver.phi_prev) == Norb:
+            orbitals = [solver.phi_prev[orb][-1] for orb in range(Norb)]
+        #The Coulomb potential of the previous geometry is not a valid starting point for an incremental update
+        solver.coulombState = None
+        solver.init_orbitals(R, Z, orbitals, Norb)
+        iterations = solver.scfRun(thrs)
+        out = {"R": [list(pos) for pos in R], "Z": list(Z), "iterations": iterations, "E_pp": float(solver.E_pp),
+               "energies": [float(E) for E in solver.E_n]}
+        if self.response:
+            polar = PolarizabilitySolver(solver)
+            polar.init_molec()
+            out["alpha"] = polar.scfRun(thrs, self.responseIter).tolist()
+        out["time"] = time.perf_counter() - start
+        return out
+
+    def run(self, geometries, thrs = 1e-3, output = None, orbitals = None, Norb = None):
+        """
+        Args:
+            geometries (list): pairs (R, Z) in bohr
+            thrs (float): SCF (and response) convergence threshold
+            output (file): table the results are streamed to, None writes no table
+            orbitals (list of vampyr.vampyr3d.FunctionTree): starting orbitals of the first geometry, the core guess by default
+            Norb (int): number of orbitals, half the number of electrons by default
+
+        Returns:
+            list of dict: results of every geometry
+        """
+        if Norb is None and orbitals is not None:
+            Norb = len(orbitals)
+        for index, (R, Z) in enumerate(geometries):
+            count = Norb if Norb is not None else (int(sum(Z)) + 1)//2
+            result = self.runGeometry(R, Z, thrs, orbitals if index == 0 else None, count)
+            result["index"] = index
+            self.results.append(result)
+            if output is not None:
+                if index == 0:
+                    output.write("\t".join(tableHeader(result)) + "\n")
+                output.write("\t".join(tableRow(result)) + "\n")
+                output.flush()
+        return self.results
+
+
+def tableHeader(result):
+    columns = ["index", "R", "Z", "iterations", "time", "E_pp"] + [f"E_{orb}" for orb in range(len(result["energies"]))]
+    if "alpha" in result:
+        columns += [f"alpha_{'xyz'[i]}{'xyz'[j]}" for i in range(3) for j in range(3)] + ["alpha_iso"]
+    return columns
+
+def tableRow(result):
+    row = [str(result["index"]), json.dumps(result["R"]), json.dumps(result["Z"]), str(result["iterations"]),
+           f"{result['time']:.3f}", f"{result['E_pp']:.10f}"] + [f"{E:.10f}" for E in result["energies"]]
+    if "alpha" in result:
+        alpha = np.array(result["alpha"])
+        row += [f"{value:.6f}" for value in alpha.flatten()] + [f"{np.trace(alpha)/3.:.6f}"]
+    return row
+
+def displaceAtom(R, Z, atom, direction, displacements):
+    """
+    Geometries where atom is moved by every displacement along direction, e.g. a bond stretch.
+
+    Returns:
+        list: pairs (R, Z)
+    """
+    direction = np.array(direction, dtype=float)
+    direction = direction/np.linalg.norm(direction)
+    geometries = []
+    for d in displacements:
+        pos = [list(p) for p in R]
+        pos[atom] = list(np.array(R[atom], dtype=float) + d*direction)
+        geometries.append((pos, list(Z)))
+    return geometries
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="SCF (and static polarizability) along a list of geometries, warm-started from one geometry to the next")
+    parser.add_argument("geometries", help="JSON file with a list of geometries {\"R\": [[x, y, z], ...], \"Z\": [...]} in bohr")
+    parser.add_argument("--prec", type=float, default=1.0e-4)
+    parser.add_argument("--khist", type=int, default=5)
+    parser.add_argument("--thrs", type=float, default=None, help="convergence threshold, 10*prec by default")
+    parser.add_argument("--norb", type=int, default=None, help="number of orbitals, half the number of electrons by default")
+    parser.add_argument("--response", action="store_true", help="also compute the static polarizability at every geometry")
+    parser.add_argument("--response-iter", type=int, default=10)
+    parser.add_argument("--output", default=None, help="table file, stdout by default")
+    args = parser.parse_args()
+
+    with open(args.geometries) as f:
+        geometries = [(geometry["R"], geometry["Z"]) for geometry in json.load(f)]
+    thrs = args.thrs if args.thrs is not None else args.prec*10
+    scan = GeometryScan(scfsolv(args.prec, args.khist), args.response, args.response_iter)
+    if args.output is None:
+        scan.run(geometries, thrs, sys.stdout, Norb=args.norb)
+    else:
+        with open(args.output, "w") as f:
+            scan.run(geometries, thrs, f, Norb=args.norb)
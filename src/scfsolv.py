@@ -1,10 +1,25 @@
 from vampyr import vampyr3d as vp
 import numpy as np
-import matplotlib.pyplot as plt
+import time
+import threading
 # from copy import deepcopy
 
-# import KAIN
+import KAIN
 import utils
+import opcache
+import parallel
+import history
+import observers
+import ortho
+import checkpoint
+import guess
+import accelerator
+import taskgraph
+import properties
+
+def addTerm(acc, term): #acc + term, for sums that may start empty
+    return term if acc is None else acc + term
+
 
 class scfsolv:
     world : vp.BoundingBox
@@ -14,60 +29,308 @@ class scfsolv:
     Pois : vp.PoissonOperator               #Poisson operator
     D : vp.ABGVDerivative                   #derivative operator
     G_mu : list                             #list of Helmholtz operator for every orbital
+    helmholtz : opcache.HelmholtzCache      #cache of Helmholtz operators, shared with the response solvers
+    precOperators : dict                    #projector and Poisson operator of every precision used so far
     Norb : int                              #number of orbitals
     Fock : np.ndarray                       #Fock matrix
     Vnuc : vp.FunctionTree                  #nuclear potential
+    nucModel : str                          #"smooth": Poisson potential of Gaussian nuclear charges, "point": point charges projected with a batched callback
     J : vp.FunctionTree                     #Coulomb potential
     K : list                                #list of exchange potential applied to each orbital
     phi_prev : list                         #list of all orbitals and their KAIN history
     f_prev : list                           #list of all orbitals updates and their KAIN history
     khist : int                             #KAIN history size 
+    kainGram : list                         #rolling KAIN inner products of every orbital
+    accelerator : str                       #convergence accelerator of the orbitals, one of accelerator.ACCELERATORS
+    cropSize : int                          #number of optimal vectors kept per orbital by the CROP accelerator
+    accelerators : list                     #accelerator.Accelerator of every orbital
+    historyStore : history.HistoryStore     #optional out-of-core storage of the KAIN histories, None keeps them in RAM
     R : list                                #list of all coordinates of each atom
     Z : list                                #list of all atomic numbers of each atom
     Nz : int                                #number of atoms
     E_pp : float                            #internal nuclear energy
     E_n : list                              #List of orbital energies
+    orbVersion : int                        #version counter of the orbitals, bumped every time they change
+    cache : opcache.IterationCache          #cache of the operator applications for the current orbitals
+    mraParams : dict                        #parameters of the MRA, needed to rebuild it in worker processes
+    executor : parallel.OrbitalExecutor     #worker pool for the per-orbital steps
+    observers : list                        #observers of the SCF events, none means headless
+    orthoMethod : str                       #"lowdin" (symmetric) or "cholesky" (Gram-Schmidt) orthonormalisation
+    orthoTol : float                        #orthonormalisation is skipped if max|S - 1| <= orthoTol*prec
+    iteration : int                         #number of SCF iterations done so far, restored from checkpoints
+    checkpointer : checkpoint.Checkpointer  #optional periodic checkpoints of the SCF state
+    cropping : bool                         #crop new orbitals, corrections and potentials to the working precision
+    cropFactor : float                      #trees are cropped to cropFactor*prec, raised when the node budget is exceeded
+    maxCropFactor : float                   #loosest cropping allowed by the node budget
+    nodeBudget : int                        #optional maximum number of nodes held by the solver
+    coulombMode : str                       #"full": Poisson solve of the whole density, "incremental": of its change only
+    coulombRebuild : int                    #number of incremental Coulomb updates between two full rebuilds
+    coulombState : dict                     #source, potential, precision and update count of the last Coulomb build
+    exchangeScreen : float                  #exchange pairs with ||phi_i*phi_j|| < exchangeScreen*prec*||phi_i||*||phi_j|| are skipped, None disables screening
+    screenStats : dict                      #number of exchange pairs considered and skipped since the solver was created
+    fockGraph : dict                        #options of the task-graph Fock build (workers, memoryLimitMB), None for the sequential build
 
 
 
     def __init__(self, prec, khist, lgdrOrder=6, sizeScale=-4, nboxes=2, scling=1.0) -> None:
         self.world = vp.BoundingBox(corner=[-1]*3, nboxes=[nboxes]*3, scaling=[scling]*3, scale= sizeScale)
         self.mra = vp.MultiResolutionAnalysis(order=lgdrOrder, box=self.world)
+        self.mraParams = {"lgdrOrder": lgdrOrder, "sizeScale": sizeScale, "nboxes": nboxes, "scling": scling}
         self.prec = prec
         self.P_eps = vp.ScalingProjector(self.mra, self.prec) 
         self.Pois = vp.PoissonOperator(self.mra, self.prec)
+        self.precOperators = {self.prec: (self.P_eps, self.Pois)}
         #Derivative operator
         self.D = vp.ABGVDerivative(self.mra, a=0.5, b=0.5)
+        #Helmholtz operators are only rebuilt when mu moves by more than muTol
+        self.helmholtz = opcache.HelmholtzCache()
         #Physical properties (placeholder values)
         self.Norb = 1
         self.Fock = np.zeros((self.Norb, self.Norb))
         self.J = self.P_eps(utils.Fzero)
         self.Vnuc = self.P_eps(utils.Fzero)
+        self.nucModel = "smooth"
         self.K = []
         self.R = []
         self.Z = []
         self.Nz = 1
         self.E_pp = 0.0
+        self.E_n = []
+        self.G_mu = []
         #Accelerator
         self.khist = khist
         self.phi_prev = []
         self.f_prev = []
+        self.kainGram = []
+        self.accelerator = "kain"
+        self.cropSize = 3
+        self.accelerators = []
+        self.historyStore = None
+        #Operator cache, valid as long as orbVersion is unchanged
+        self.orbVersion = 0
+        self.cache = opcache.IterationCache()
+        #Per-orbital steps are serial unless setExecution is called
+        self.executor = parallel.OrbitalExecutor()
+        #Headless by default
+        self.observers = []
+        self.orthoMethod = "lowdin"
+        self.orthoTol = 0.1
+        #Checkpoints are disabled unless enableCheckpoints is called
+        self.iteration = 0
+        self.checkpointer = None
+        #Memory management, off unless setCropping is called
+        self.cropping = False
+        self.cropFactor = 1.0
+        self.maxCropFactor = 8.0
+        self.nodeBudget = None
+        #Coulomb potential rebuilt from the whole density unless setCoulombMode is called
+        self.coulombMode = "full"
+        self.coulombRebuild = 5
+        self.coulombState = None
+        #Exchange pair screening, off unless setExchangeScreening is called
+        self.exchangeScreen = None
+        self.screenStats = {"pairs": 0, "skipped": 0}
+        self.screenLock = threading.Lock()
+        #Sequential Fock build unless setFockGraph is called
+        self.fockGraph = None
         # print(self.world)
 
-    def init_molec(self, No,  pos, Z, init_g_dir) -> None:
-        self.Nz = len(Z)
-        self.Norb = No
-        self.R = pos
-        self.Z = Z
-        self.Vnuc = self.P_eps(lambda r : self.f_nuc(r))
+    def setExecution(self, mode = "serial", workers = None): #mode is one of "serial", "thread" or "process"
+        self.executor.shutdown()
+        self.executor = parallel.OrbitalExecutor(mode, workers)
+
+    def useHistoryStore(self, budgetMB, directory = None): #Keeps the KAIN histories within budgetMB of RAM, spilling older trees to directory
+        self.historyStore = history.HistoryStore(self.mra, budgetMB, directory)
+        self.phi_prev = [self.newHistory(hist) for hist in self.phi_prev]
+        self.f_prev = [self.newHistory(hist) for hist in self.f_prev]
+        self.resetAccelerators(len(self.kainGram))
+
+    def setAccelerator(self, name = "kain", cropSize = 3): #name is "kain" (history of khist iterates) or "crop" (constant memory)
+        if name not in accelerator.ACCELERATORS:
+            raise ValueError(f"Unknown accelerator {name}, expected one of {accelerator.ACCELERATORS}")
+        self.accelerator = name
+        self.cropSize = cropSize
+        self.resetAccelerators(len(self.kainGram))
+
+    def resetAccelerators(self, Norb = None): #New accelerators, and KAIN inner products, for every orbital
+        if Norb is None:
+            Norb = self.Norb
+        self.kainGram = [KAIN.KainGram() for i in range(Norb)]
+        if self.accelerator == "crop":
+            self.accelerators = [accelerator.CropAccelerator(self.cropSize) for i in range(Norb)]
+        else:
+            self.accelerators = [accelerator.KainAccelerator(self.kainGram[i], self.khist) for i in range(Norb)]
+
+    #Observers
+    def addObserver(self, observer):
+        self.observers.append(observer)
+
+    def removeObserver(self, observer):
+        self.observers.remove(observer)
+
+    def emit(self, event, payload = None): #payload is a callable returning the event data, only called if an observer wants the event
+        listeners = [obs for obs in self.observers if obs.wants(event)]
+        if len(listeners) == 0:
+            return
+        data = payload() if payload is not None else {}
+        for obs in listeners:
+            obs.notify(event, self, data)
+
+    def diagnostic(self, name, value): #Debugging output, value is a callable only evaluated if an observer wants diagnostics
+        self.emit("diagnostic", lambda : {"name": name, "value": value()})
+
+    def setPrecision(self, prec): #Switches the working precision, the orbitals and KAIN histories are kept
+        if prec == self.prec:
+            return
+        self.prec = prec
+        if prec not in self.precOperators:
+            self.precOperators[prec] = (vp.ScalingProjector(self.mra, prec), vp.PoissonOperator(self.mra, prec))
+        self.P_eps, self.Pois = self.precOperators[prec]
+        #Precision-dependent quantities
+        if len(self.Z) > 0:
+            self.Vnuc = self.projectNuclearPotential()
+        self.G_mu = [self.helmholtz.get(self.mra, np.sqrt(-2*E), prec) for E in self.E_n]
+        self.markOrbitalsChanged()
+
+    #Memory management
+    def setCropping(self, enabled = True, nodeBudget = None, maxCropFactor = 8.0): #Crops new trees to prec, and with a node budget loosens the cropping up to maxCropFactor*prec
+        self.cropping = enabled
+        self.nodeBudget = nodeBudget
+        self.maxCropFactor = maxCropFactor
+        self.cropFactor = 1.0
+
+    def cropTree(self, tree): #Crops tree in place to the working precision, returns it
+        if self.cropping:
+            tree.crop(self.cropFactor*self.prec)
+        return tree
+
+    def memoryGroups(self): #Trees held by the solver, by group. The older history entries were cropped when they were added
+        #"shared" trees belong to another solver or are never rebuilt (Vnuc is projected once per geometry), they are counted but never cropped
+        return {"orbitals": [hist[-1] for hist in self.phi_prev],
+                "histories": [tree for hist in self.phi_prev + self.f_prev for tree in history.residentTrees(hist)] + [tree for acc in self.accelerators for tree in acc.trees()],
+                "potentials": [self.J] + list(self.K),
+                "shared": [self.Vnuc]}
+
+    def nodeCounts(self):
+        counts = {name: sum(tree.getNNodes() for tree in trees) for name, trees in self.memoryGroups().items()}
+        #The current orbitals are also the last history entries
+        counts["total"] = counts["histories"] + counts["potentials"] + counts["shared"]
+        return counts
+
+    def markCropped(self): #The cached operators and the accelerator inner products were built from the uncropped trees
+        self.markOrbitalsChanged()
+        for acc in self.accelerators:
+            acc.refresh()
+
+    def manageMemory(self):
+        """
+        Memory pass run after every iteration: reports the node counts and, if the node budget is exceeded, crops the
+        current orbitals, resident histories and potentials again with a loosened precision, up to maxCropFactor*prec.
+        The cropping is relaxed again once the nodes fall below half the budget.
+        """
+        counts = self.nodeCounts()
+        if self.nodeBudget is not None and self.cropping:
+            if counts["total"] > self.nodeBudget and self.cropFactor < self.maxCropFactor:
+                #The checkpoint being written may hold the trees about to be cropped
+                if self.checkpointer is not None:
+                    self.checkpointer.wait()
+                while counts["total"] > self.nodeBudget and self.cropFactor < self.maxCropFactor:
+                    self.cropFactor = min(2*self.cropFactor, self.maxCropFactor)
+                    groups = self.memoryGroups()
+                    for tree in groups["histories"] + groups["potentials"]:
+                        self.cropTree(tree)
+                    counts = self.nodeCounts()
+                self.markCropped()
+                if self.historyStore is not None:
+                    self.historyStore.refresh()
+            elif counts["total"] < self.nodeBudget/2 and self.cropFactor > 1.0:
+                self.cropFactor = max(self.cropFactor/2, 1.0)
+        self.emit("memory", lambda : {"nodes": counts, "cropFactor": self.cropFactor})
+        return counts
+
+    #Checkpoint/restart
+    def enableCheckpoints(self, directory, every = 1, keep = 2): #Writes the SCF state to directory every `every` iterations
+        self.checkpointer = checkpoint.Checkpointer(directory, every, keep)
+
+    def saveCheckpoint(self, force = False):
+        if self.checkpointer is not None:
+            self.checkpointer.save(self, self.iteration, force)
+
+    def checkpointState(self): #Snapshot of everything needed to resume the SCF exactly at the current iteration
+        state = {"values": {"kind": "scfsolv", "Norb": self.Norb, "R": np.asarray(self.R, dtype=float).tolist(), "Z": np.asarray(self.Z).tolist(),
+                            "prec": self.prec, "khist": self.khist, "accelerator": self.accelerator, "cropSize": self.cropSize},
+                 "arrays": {"Fock": self.Fock, "E_n": np.array(self.E_n)},
+                 "trees": {"phi_prev": [list(hist) for hist in self.phi_prev], "f_prev": [list(hist) for hist in self.f_prev]}}
+        #Own state of the accelerators (CROP optimal vectors), one tree list and one array per orbital and name
+        for orb, acc in enumerate(self.accelerators):
+            trees, arrays = acc.checkpointState()
+            for name, value in trees.items():
+                state["trees"].setdefault(f"acc_{name}", []).append(value)
+            for name, value in arrays.items():
+                state["arrays"][f"acc_{name}_{orb}"] = value
+        return state
+
+    def restart(self, directory): #Resumes from the latest complete checkpoint of directory
+        self.restoreState(checkpoint.load(directory, self.mra))
+
+    def restoreState(self, state):
+        values = state["values"]
+        self.setPrecision(values["prec"])
+        self.khist = values["khist"]
+        self.Norb = values["Norb"]
+        self.R = values["R"]
+        self.Z = values["Z"]
+        self.Nz = len(self.Z)
+        self.Vnuc = self.projectNuclearPotential()
+        self.E_pp = self.fpp()
+        self.phi_prev = [self.newHistory(hist) for hist in state["trees"]["phi_prev"]]
+        self.f_prev = [self.newHistory(hist) for hist in state["trees"]["f_prev"]]
+        self.accelerator = values.get("accelerator", self.accelerator)
+        self.cropSize = values.get("cropSize", self.cropSize)
+        self.resetAccelerators()
+        for orb, acc in enumerate(self.accelerators):
+            names = [key[4:] for key in state["trees"] if key.startswith("acc_")]
+            trees = {name: state["trees"][f"acc_{name}"][orb] for name in names}
+            arrays = {key[4:].rsplit("_", 1)[0]: value for key, value in state["arrays"].items() if key.startswith("acc_") and key.rsplit("_", 1)[1] == str(orb)}
+            if len(trees) > 0 or len(arrays) > 0:
+                acc.restoreState(trees, arrays)
+        self.Fock = state["arrays"]["Fock"]
+        self.E_n = list(state["arrays"]["E_n"])
+        self.G_mu = [self.helmholtz.get(self.mra, np.sqrt(-2*E), self.prec) for E in self.E_n]
+        self.coulombState = None
+        self.iteration = state["iteration"]
+        self.markOrbitalsChanged()
+
+    def newHistory(self, trees = ()): #History of one orbital, a plain list or a store-backed list
+        if self.historyStore is None:
+            return list(trees)
+        return self.historyStore.newHistory(trees)
+
+    def init_molec(self, No,  pos, Z, init_g_dir = None) -> None: #Without init_g_dir, the initial guess is built by guess.coreGuess
+        if init_g_dir is None:
+            self.init_orbitals(pos, Z, None, No)
+            return
         #initial guesses provided by mrchem
-        self.phi_prev = []
-        for i in range(self.Norb):
+        orbitals = []
+        for i in range(No):
             ftree = vp.FunctionTree(self.mra)
-            print(f"{init_g_dir}phi_p_scf_idx_{i}_re")
+            self.diagnostic("Loading", lambda : f"{init_g_dir}phi_p_scf_idx_{i}_re")
             ftree.loadTree(f"{init_g_dir}phi_p_scf_idx_{i}_re") 
-            self.phi_prev.append([ftree])
-        self.f_prev = [[] for i in range(self.Norb)] #list of the corrections at previous steps
+            orbitals.append(ftree)
+        self.init_orbitals(pos, Z, orbitals)
+
+    def init_orbitals(self, pos, Z, orbitals = None, No = None) -> None: #Same as init_molec, with the initial guesses given as a list of trees
+        self.Nz = len(Z)
+        self.R = pos
+        self.Z = Z
+        self.Vnuc = self.projectNuclearPotential()
+        if orbitals is None:
+            orbitals = guess.coreGuess(self, No)
+        self.Norb = len(orbitals)
+        self.phi_prev = [self.newHistory([orbital]) for orbital in orbitals]
+        self.markOrbitalsChanged()
+        self.f_prev = [self.newHistory() for i in range(self.Norb)] #list of the corrections at previous steps
+        self.resetAccelerators()
         #Compute the Fock matrix and potential operators 
         self.compFock()
         # print("squalalala",self.Fock)
@@ -83,7 +346,7 @@ class scfsolv:
             # self.E_n.append(2*F[i]+E_pp)
             mu = np.sqrt(-2*self.E_n[i])
             # mu = 1 #E = -0.5 analytical solution
-            self.G_mu.append(vp.HelmholtzOperator(self.mra, mu, self.prec))  # Initalize the operator
+            self.G_mu.append(self.helmholtz.get(self.mra, mu, self.prec))  # Initalize the operator
         for orb in range(self.Norb):
             #First establish a history (at least one step) of corrections to the orbital with standard iterations with Helmholtz operator to create
             # Apply Helmholtz operator to obtain phi_np1 #5
@@ -92,29 +355,98 @@ class scfsolv:
             self.f_prev[orb].append(phi_np1 - self.phi_prev[orb][-1])
             phi_np1.normalize()
             self.phi_prev[orb].append(phi_np1)
+        #The Fock matrix above was built from the guess, even if the orthonormalisation below leaves the orbitals unchanged
+        self.markOrbitalsChanged()
         #Orthonormalise orbitals since they are molecular orbitals
-        phi_ortho = self.orthonormalise()
+        self.replaceCurrentOrbitals(self.orthonormalise())
+
+    def replaceCurrentOrbitals(self, phi_new): #Replaces the current step of every orbital, the cached operators stay valid if nothing changed
+        changed = False
         for orb in range(self.Norb): #Mandatory loop due to questionable data format choice.
-            self.phi_prev[orb][-1] = phi_ortho[orb]
+            if phi_new[orb] is not self.phi_prev[orb][-1]:
+                self.phi_prev[orb][-1] = phi_new[orb]
+                changed = True
+        if changed:
+            self.markOrbitalsChanged()
 
     # def compOperators(self): #Compute operators 
 
 
+    #Operator cache
+    def markOrbitalsChanged(self): #Must be called whenever the current orbitals are modified, invalidates the cached operators
+        self.orbVersion += 1
+
+    def stateVersion(self): #Version of everything the cached operators depend on
+        return (self.orbVersion,)
+
+    def cacheStats(self):
+        return {"operators": self.cache.stats(), "helmholtz": self.helmholtz.stats()}
+
     #computation of operators
     def compFock(self): 
+        version = self.stateVersion()
+        cached = self.cache.get("fock", version)
+        if cached is not None:
+            self.Fock, self.J, self.K = cached
+            return
+        if self.fockGraph is not None:
+            self.compFockGraph(version)
+            return
         self.Fock = np.zeros((self.Norb, self.Norb))
-        self.K = []
-        self.J = self.computeCoulombPot()
+        self.J = self.cropTree(self.computeCoulombPot())
+        #Compute the exchange potential applied to every orbital at once (pair-symmetric)
+        self.K = [self.cropTree(K_i) for K_i in self.computeExchangePotentials()]
         for j in range(self.Norb):
-            #Compute the potential operator
-            self.K.append(self.computeExchangePotential(j))
             # V = Vnuc
             # compute the energy from the orbitals 
             Fphi = self.compFop(j)
             for i in range(self.Norb):
                 self.Fock[i,j] = vp.dot(self.phi_prev[i][-1], Fphi)
+        self.cache.store("fock", version, (self.Fock, self.J, self.K))
+
+    def setFockGraph(self, workers = 1, memoryLimitMB = None): #Runs compFock as a task graph on workers threads, workers = None restores the sequential build
+        self.fockGraph = None if workers is None else {"workers": workers, "memoryLimitMB": memoryLimitMB}
+        self.cache.clear()
+
+    def compFockGraph(self, version):
+        """
+        Builds J, K, F phi and the Fock matrix as a taskgraph.TaskGraph: Coulomb source and potential, pair densities and
+        pair potentials of the non-screened pairs, exchange potentials, second derivatives, F phi and the inner products.
+        The pair densities and potentials and the derivatives are freed as soon as they have been used.
+        """
+        phi = [self.phi_prev[i][-1] for i in range(self.Norb)]
+        norms = self.pairNorms(phi)
+        pairs = [(i, j) for i in range(self.Norb) for j in range(i, self.Norb) if i == j or not self.screenPair(norms, i, j)]
+        graph = taskgraph.TaskGraph()
+        graph.add(("rho",), self.coulombSource)
+        graph.add(("J",), lambda rho : self.cropTree(self.solveCoulomb(rho)), [("rho",)], keep=True)
+        for (i, j) in pairs:
+            graph.add(("rho", i, j), lambda i=i, j=j : 4*np.pi*phi[i]*phi[j])
+            graph.add(("V", i, j), self.Pois, [("rho", i, j)])
+        for i in range(self.Norb):
+            #K_i = Sum_j phi_j*V_ij over the pairs containing i
+            partners = [j if i == k else k for (k, j) in pairs if i in (k, j)]
+            graph.add(("K", i), lambda *V, partners=partners : self.cropTree(utils.linCombOne(np.ones(len(V)), [phi[j]*V_ij for j, V_ij in zip(partners, V)], self.prec, self.mra)),
+                      [("V", min(i, j), max(i, j)) for j in partners], keep=True)
+            for d in range(3):
+                graph.add(("DD", i, d), lambda i=i, d=d : self.D(self.D(phi[i], d), d))
+            graph.add(("Fphi", i), lambda DDx, DDy, DDz, J, K_i, i=i : utils.linCombOne([-0.5, -0.5, -0.5, 1., -1.], [DDx, DDy, DDz, (self.Vnuc + J)*phi[i], K_i], self.prec, self.mra),
+                      [("DD", i, 0), ("DD", i, 1), ("DD", i, 2), ("J",), ("K", i)], keep=True)
+            graph.add(("F", i), lambda Fphi : np.array([vp.dot(phi[k], Fphi) for k in range(self.Norb)]), [("Fphi", i)], keep=True)
+        results = graph.run(self.fockGraph["workers"], self.fockGraph["memoryLimitMB"])
+        self.recordScreening(norms, [(i, j) for i in range(self.Norb) for j in range(i+1, self.Norb)])
+        self.diagnostic("Fock task graph", lambda : graph.stats)
+        self.J = results[("J",)]
+        self.K = [results[("K", i)] for i in range(self.Norb)]
+        self.Fock = np.transpose([results[("F", j)] for j in range(self.Norb)])
+        for j in range(self.Norb):
+            self.cache.store(("Fphi", j), version, results[("Fphi", j)])
+        self.cache.store("fock", version, (self.Fock, self.J, self.K))
+
+    def compFop(self, orb): #Computes the Fock operator applied to an orbital orb, cached until the orbitals change
+        return self.cache.lookup(("Fphi", orb), self.stateVersion(), lambda : self.applyFock(orb))
 
-    def compFop(self, orb): #Computes the Fock operator applied to an orbital orb #TODO: modifier ça pour que ça rentre dans compFock
+    def applyFock(self, orb): #TODO: modifier ça pour que ça rentre dans compFock
         Tphi = -0.5*(self.D(self.D(self.phi_prev[orb][-1], 0), 0) + self.D(self.D(self.phi_prev[orb][-1], 1), 1) + self.D(self.D(self.phi_prev[orb][-1], 2), 2)) #Laplacian of the orbitals
         # Fphi = Tphi + self.Vnuc[orderF]*self.phi_prev[orb][-1] + self.J[orderF]*self.phi_prev[orb][-1] - self.K[orb][orderF]
         Fphi = Tphi + self.Vnuc*self.phi_prev[orb][-1] + self.J*self.phi_prev[orb][-1] - self.K[orb]
@@ -126,113 +458,269 @@ class scfsolv:
         return rho
 
     def computeCoulombPot(self): 
+        return self.solveCoulomb(self.coulombSource())
+
+    def coulombSource(self): #4*pi*rho, from the pair densities of compScalarPrdt
         PNbr = 4*np.pi*self.compScalarPrdt(0, 0)
         for orb in range(1, self.Norb):
             PNbr = PNbr + 4*np.pi*self.compScalarPrdt(orb, orb)
-        return self.Pois(2*PNbr) #factor of 2 because we sum over the number of orbitals, not electrons
+        return 2*PNbr #factor of 2 because we sum over the number of orbitals, not electrons
+
+    def setCoulombMode(self, mode = "incremental", rebuild = 5): #mode is "full" or "incremental", rebuild is the number of incremental updates between full rebuilds
+        if mode not in ("full", "incremental"):
+            raise ValueError(f"Unknown Coulomb mode {mode}, expected full or incremental")
+        self.coulombMode = mode
+        self.coulombRebuild = rebuild
+        self.coulombState = None
+
+    def solveCoulomb(self, source):
+        """
+        Solves the Poisson equation for source = 4*pi*rho.
+        In incremental mode, the previous source and potential are kept and only the change of the source is solved for,
+        J = J_prev + P[source - source_prev], the Poisson operator being linear. The correction only needs the absolute
+        accuracy of the whole potential, prec*||J||: its relative precision is scaled by ||source||/||source - source_prev||,
+        so it gets cheaper as the density converges, and a correction below prec*||source|| is skipped. The updated
+        potential is cropped back to prec, and rebuilt from the whole source every coulombRebuild updates, and when the
+        precision changes, to limit the drift.
+        """
+        state = self.coulombState
+        if self.coulombMode != "incremental" or state is None or state["count"] >= self.coulombRebuild or state["prec"] != self.prec:
+            J = self.Pois(source)
+            count = 0
+        else:
+            delta = source - state["source"]
+            ratio = delta.norm()/max(source.norm(), 1e-300)
+            J = state["J"]
+            if ratio > self.prec:
+                dJ = vp.FunctionTree(self.mra)
+                vp.advanced.apply(self.prec/ratio, dJ, self.Pois, delta)
+                J = J + dJ
+                J.crop(self.prec)
+            count = state["count"] + 1
+        if self.coulombMode == "incremental":
+            self.coulombState = {"source": source, "J": J, "prec": self.prec, "count": count}
+        return J
 
     def computeExchangePotential(self, idx):
-        K = self.phi_prev[0][-1]*self.Pois(4*np.pi*self.compScalarPrdt(0, idx))
-        for j in range(1, self.Norb):
-            K = K + self.phi_prev[j][-1]*self.Pois(4*np.pi*self.compScalarPrdt(j, idx))
-        return K 
+        norms = self.pairNorms([self.phi_prev[j][-1] for j in range(self.Norb)], [self.phi_prev[idx][-1]])
+        K = None
+        for j in range(self.Norb):
+            if self.screenPair(norms, j, 0):
+                continue
+            K = addTerm(K, self.phi_prev[j][-1]*self.Pois(4*np.pi*self.compScalarPrdt(j, idx)))
+        self.recordScreening(norms)
+        return self.zeroIfNone(K)
+
+    #Exchange screening
+    def setExchangeScreening(self, threshold = 0.1): #Skips the exchange pairs with a relative pair density below threshold*prec, None disables screening
+        self.exchangeScreen = threshold
+
+    def pairNorms(self, bra, ket = None):
+        """
+        ||bra_i*ket_j||/(||bra_i||*||ket_j||) for every pair, computed as sqrt(<bra_i^2|ket_j^2>) so that the N^2 pair
+        products are not built: only one square per function and the (cheap) dot products. The relative norm makes the
+        screening independent of the scale of the functions, e.g. of the perturbed orbitals. Pairs with a zero function
+        get 0. None if screening is disabled.
+        """
+        if self.exchangeScreen is None:
+            return None
+        squares = self.executor.map(lambda tree : tree*tree, bra)
+        ketSquares = None if ket is None else self.executor.map(lambda tree : tree*tree, ket)
+        norms = np.sqrt(np.abs(ortho.overlapMatrix(squares, ketSquares, mapper=self.executor.map)))
+        braNorms = np.array(self.executor.map(lambda tree : tree.norm(), bra))
+        ketNorms = braNorms if ket is None else np.array(self.executor.map(lambda tree : tree.norm(), ket))
+        scale = np.outer(braNorms, ketNorms)
+        return np.divide(norms, scale, out=np.zeros_like(norms), where=scale > 0)
+
+    def screenPair(self, norms, i, j): #True if the pair density (i, j) is negligible
+        return norms is not None and norms[i, j] < self.exchangeScreen*self.prec
+
+    def recordScreening(self, norms, pairs = None): #pairs restricts the count to the pairs that were actually considered
+        if norms is None:
+            return
+        if pairs is None:
+            pairs = [(i, j) for i in range(norms.shape[0]) for j in range(norms.shape[1])]
+        skipped = sum(1 for (i, j) in pairs if self.screenPair(norms, i, j))
+        #Screening is recorded from executor threads, e.g. the response directions
+        with self.screenLock:
+            self.screenStats["pairs"] += len(pairs)
+            self.screenStats["skipped"] += skipped
+        self.emit("screening", lambda : {"pairs": len(pairs), "skipped": skipped})
+
+    def zeroIfNone(self, tree): #Zero tree for a sum where every term was screened out
+        return utils.linCombOne([], [], self.prec, self.mra) if tree is None else tree
+
+    def computePairPotential(self, phi_i, phi_j): #Computes V_ij = P[phi_i*phi_j], symmetric in (i,j)
+        return self.Pois(4*np.pi*phi_i*phi_j)
+
+    def computeExchangePotentials(self): #Computes K_i for every orbital, with one Poisson solve per non-negligible orbital pair
+        phi = [self.phi_prev[i][-1] for i in range(self.Norb)]
+        norms = self.pairNorms(phi)
+        pairPotential = lambda i, j : self.computePairPotential(phi[i], phi[j])
+        if self.executor.mode == "process":
+            #All the pair potentials are solved at once on the process pool, the orbitals being shared with the workers
+            pairs = [(i, j) for i in range(self.Norb) for j in range(i, self.Norb) if i == j or not self.screenPair(norms, i, j)]
+            V = dict(zip(pairs, self.executor.applyPairPotentials(self.mra, self.mraParams, self.prec, phi, pairs)))
+            pairPotential = lambda i, j : V.pop((i, j))
+        K = [None for i in range(self.Norb)]
+        for i in range(self.Norb):
+            #Diagonal pair: only contributes to K_i
+            V_ii = pairPotential(i, i)
+            K[i] = addTerm(K[i], phi[i]*V_ii)
+            for j in range(i+1, self.Norb):
+                if self.screenPair(norms, i, j):
+                    continue
+                #Off-diagonal pair: V_ij = V_ji is reused for K_i and K_j
+                V_ij = pairPotential(i, j)
+                K[i] = K[i] + phi[j]*V_ij
+                K[j] = addTerm(K[j], phi[i]*V_ij)
+        self.recordScreening(norms, [(i, j) for i in range(self.Norb) for j in range(i+1, self.Norb)])
+        return K
     
     def expandSolution(self):
         #Orthonormalise orbitals in case they aren't yet
-        phi_ortho = self.orthonormalise()
-        for orb in range(self.Norb): #Mandatory loop due to questionable data format choice.
-            self.phi_prev[orb][-1] = phi_ortho[orb]
+        self.replaceCurrentOrbitals(self.orthonormalise())
         #Compute the fock matrix of the system
         self.compFock()
         
-        phistory = []
         self.E_n = []
-        norm = []
-        update = []
         for orb in range(self.Norb):
             self.E_n.append(self.Fock[orb, orb])
             #Redefine the Helmholtz operator with the updated energy
             mu = np.sqrt(-2*self.E_n[orb])
-            self.G_mu[orb] = vp.HelmholtzOperator(self.mra, mu, self.prec) 
-            #Compute new power iteration for the Helmholtz operator
-            phi_np1 = self.powerIter(orb)        
-            #create an alternate history of orbitals which include the power iteration
-            phistory.append([phi_np1])
+            self.G_mu[orb] = self.helmholtz.get(self.mra, mu, self.prec)
+        #Compute new power iteration for the Helmholtz operator
+        #create an alternate history of orbitals which include the power iteration
+        phistory = [[phi_np1] for phi_np1 in self.powerIterAll()]
         #Orthonormalise the alternate orbital history
         phistory = self.orthonormalise(phistory)
         # phi_prev = orthonormalise(phi_prev)
-        for orb in range(self.Norb):
-            self.f_prev[orb].append(phistory[orb] - self.phi_prev[orb][-1])
-            #Setup and solve the linear system Ac=b
-            c = self.setuplinearsystem(orb)
-            #Compute the correction delta to the orbitals 
-            delta = self.f_prev[orb][-1]
-            for j in range(len(self.phi_prev[orb])-1):
-                delta = delta + c[j]*(self.phi_prev[orb][j] - self.phi_prev[orb][-1] + self.f_prev[orb][j] - self.f_prev[orb][-1])
-            #Apply correction
-            phi_n = self.phi_prev[orb][-1]
-            phi_n = phi_n + delta
-            #Normalize
-            norm.append(phi_n.norm())
-            phi_n.normalize()
-            #Save new orbital
-            self.phi_prev[orb].append(phi_n)
-            #Correction norm (convergence metric)
-            update.append(delta.norm())
-            if len(self.phi_prev[orb]) > self.khist: #deleting oldest element to save memory
-                del self.phi_prev[orb][0]
-                del self.f_prev[orb][0]
+        #The KAIN corrections are independent across orbitals
+        corrections = self.executor.map(lambda orb : self.correctOrbital(orb, phistory[orb]), range(self.Norb))
+        norm = [corr[0] for corr in corrections]
+        update = [corr[1] for corr in corrections]
         return np.array(self.E_n), np.array(norm), np.array(update)
+
+    def correctOrbital(self, orb, phi_np1): #Accelerated correction and normalisation of one orbital, only touches the history of orb
+        self.f_prev[orb].append(self.cropTree(phi_np1 - self.phi_prev[orb][-1]))
+        #Compute the correction delta to the orbitals (KAIN: setup and solve the linear system Ac=b)
+        delta = self.accelerators[orb].correction(self.phi_prev[orb], self.f_prev[orb], self.prec, self.mra)
+        #Apply correction
+        phi_n = self.phi_prev[orb][-1]
+        phi_n = self.cropTree(phi_n + delta)
+        #Normalize
+        norm = phi_n.norm()
+        phi_n.normalize()
+        #Save new orbital
+        self.phi_prev[orb].append(phi_n)
+        #Concurrent bumps from other orbitals may collapse into one, the version still differs from the one of the cached operators
+        self.markOrbitalsChanged()
+        #Correction norm (convergence metric)
+        update = delta.norm()
+        #deleting oldest elements to save memory
+        self.accelerators[orb].trim(self.phi_prev[orb], self.f_prev[orb])
+        return norm, update
     
+    def kainDelta(self, phis, fs, c): #delta = f_m + Sum_j c_j*(phi_j - phi_m + f_j - f_m), built in a single pass
+        return accelerator.kainDelta(phis, fs, c, self.prec, self.mra)
+
     def powerIter(self, orb):
-        #Compute phi_ortho := Sum_{j!=i} F_ij*phi_j 
-        phi_ortho = self.P_eps(utils.Fzero) 
-        for orb2 in range(self.Norb):
-            #Compute off-diagonal Fock matrix elements
-            if orb2 != orb:
-                phi_ortho = phi_ortho + self.Fock[orb, orb2]*self.phi_prev[orb2][-1]
-        return -2*self.G_mu[orb]((self.Vnuc + self.J)*self.phi_prev[orb][-1] - self.K[orb] - phi_ortho)
+        return -2*self.G_mu[orb](self.helmholtzArgument(orb))
+
+    def powerIterAll(self): #Power iteration of every orbital on the executor, in orbital order
+        if self.executor.mode == "process":
+            #Only the Helmholtz applications are sent to the worker processes
+            arguments = [self.helmholtzArgument(orb) for orb in range(self.Norb)]
+            mus = [self.helmholtz.quantize(np.sqrt(-2*self.helmholtzEnergy(orb))) for orb in range(self.Norb)]
+            return self.executor.applyHelmholtz(self.mra, self.mraParams, self.prec, self.G_mu, mus, arguments)
+        return self.executor.map(self.powerIter, range(self.Norb))
+
+    def helmholtzEnergy(self, orb): #Energy of the Helmholtz operator G_mu[orb], mu = sqrt(-2*E)
+        return self.E_n[orb]
+
+    def helmholtzShift(self, orb):
+        #G_mu[orb] is built with the quantized mu_q of the Helmholtz cache: (-Lap + mu_q^2) phi = -2(V + (mu^2 - mu_q^2)/2) phi
+        #has the same solution as the equation of the exact mu, so (mu^2 - mu_q^2)/2 phi is added to the argument
+        mu = np.sqrt(-2*self.helmholtzEnergy(orb))
+        return (mu**2 - self.helmholtz.quantize(mu)**2)/2
+
+    def helmholtzArgument(self, orb): #Right hand side of the Helmholtz equation of orbital orb
+        #(Vnuc + J)phi_i - K phi_i - Sum_{j!=i} F_ij*phi_j + shift*phi_i, as a single linear combination
+        coefs = [1., -1.] + [-self.Fock[orb, orb2] if orb2 != orb else self.helmholtzShift(orb) for orb2 in range(self.Norb)]
+        trees = [(self.Vnuc + self.J)*self.phi_prev[orb][-1], self.K[orb]] + [self.phi_prev[orb2][-1] for orb2 in range(self.Norb)]
+        return utils.linCombOne(coefs, trees, self.prec, self.mra)
     
     def setuplinearsystem(self,orb):
-        lenHistory = len(self.phi_prev[orb])
-        # Compute matrix A
-        A = np.zeros((lenHistory-1, lenHistory-1))
-        b = np.zeros(lenHistory-1)
-        for l in range(lenHistory-1):  
-            dPhi = self.phi_prev[orb][l] - self.phi_prev[orb][-1]
-            b[l] = vp.dot(dPhi, self.f_prev[orb][-1])
-            for j in range(lenHistory-1):
-                A[l,j] = -vp.dot(dPhi, self.f_prev[orb][j] - self.f_prev[orb][-1])
+        # Compute matrix A and vector b from the rolling inner products <phi_l|f_j>
+        G = self.kainGram[orb].update(self.phi_prev[orb], self.f_prev[orb])
+        A, b = KAIN.kainLinearSystem(G)
         #solve Ac = b for c
         c = np.linalg.solve(A, b)
         return c
 
-    def scfRun(self, thrs = 1e-3, printVal = False, pltShow = False):
+    def scfRun(self, thrs = 1e-3, printVal = False, pltShow = False, maxIter = None): #printVal and pltShow add a print and a plot observer for this run, maxIter caps the iterations
         update = np.ones(self.Norb)
         norm = np.zeros(self.Norb)
+        runObservers = observers.fromFlags(printVal, pltShow)
+        self.observers.extend(runObservers)
 
         #iteration counter
         i = 0
 
         # Optimization loop (KAIN) #TODO continuer
-        while update.max() > thrs:
-            print(f"=============Iteration: {i}")
-            i += 1 
-            self.E_n, norm, update = self.expandSolution()
-
-            for orb in range(self.Norb):
-                # this will plot the wavefunction at each iteration
-                r_x = np.linspace(-5., 5., 1000)
-                phi_n_plt = [self.phi_prev[orb][-1]([x, 0.0, 0.0]) for x in r_x]
-                plt.plot(r_x, phi_n_plt) 
-                
-                if printVal:
-                    print(f"Orbital: {orb}    Norm: {norm}    Update: {update}    Energy:{self.E_n}")
-
-        if pltShow:
-            plt.show()
+        try:
+            while update.max() > thrs and (maxIter is None or i < maxIter):
+                start = time.perf_counter()
+                self.E_n, norm, update = self.expandSolution()
+                elapsed = time.perf_counter() - start
+                self.manageMemory()
+                self.iteration += 1
+                self.saveCheckpoint()
+                self.emit("iteration", lambda : {"iteration": i, "energies": self.E_n, "norms": norm, "updates": update, "time": elapsed})
+                i += 1 
+            self.emit("finish", lambda : {"iterations": i})
+            #The converged state is always written
+            self.saveCheckpoint(force=True)
+            if self.checkpointer is not None:
+                self.checkpointer.wait()
+        finally:
+            for obs in runObservers:
+                self.removeObserver(obs)
+        return i
+
+    def scfRunLadder(self, thrs = 1e-3, precs = None, steps = 3, factor = 10., printVal = False, pltShow = False):
+        #Coarse-to-fine SCF: converges at loose precisions first and tightens the precision step by step.
+        #Orbitals and KAIN histories are carried across the steps, the last step runs at the precision of the solver with thrs.
+        target = self.prec
+        if precs is None:
+            precs = [target*factor**k for k in range(steps-1, 0, -1)]
+        precs = [prec for prec in precs if prec > target] + [target]
+        iterations = []
+        for prec in precs:
+            self.setPrecision(prec)
+            #Convergence threshold related to the working precision
+            iterations.append(self.scfRun(thrs*prec/target, printVal, pltShow))
+        return iterations
 
     #Utilities
+    def projectNuclearPotential(self):
+        if self.nucModel == "point":
+            #All nuclei are handled by one NumPy expression per quadrature point
+            R = np.array(self.R, dtype=float)
+            Z = np.array(self.Z, dtype=float)
+            return self.P_eps(lambda r : -np.dot(Z, 1/np.sqrt(((R - r)**2).sum(axis=1))))
+        #Smoothed nuclei: the Gaussian charges are projected and the Poisson operator applied without any Python callback
+        return -1*self.Pois(4*np.pi*self.P_eps(self.nuclearCharges()))
+
+    def nuclearCharges(self): #Normalised Gaussian charge of every nucleus, as a vp.GaussExp
+        rho = vp.GaussExp()
+        for nuc in range(self.Nz):
+            #Smoothing width of MRChem's nuclear model, c = (0.00435*prec/Z^5)^(1/3)
+            width = (0.00435*self.prec/self.Z[nuc]**5)**(1./3.)
+            alpha = 1./width**2
+            rho.append(vp.GaussFunc(exp=alpha, coef=self.Z[nuc]*(alpha/np.pi)**(3./2.), pos=self.R[nuc], pow=[0,0,0]))
+        return rho
+
     def f_nuc(self, r):   
         out = 0
         #electron-nucleus interaction
@@ -241,12 +729,11 @@ class scfsolv:
         return out
     
     def fpp(self):
-        #nucleus-nucleus interaction
-        out = 0
-        for i in range(self.Nz-1):
-            for j in range(i+1, self.Nz):
-                out += self.Z[i]*self.Z[j]/np.sqrt((self.R[j][0]-self.R[i][0])**2 + (self.R[j][1]-self.R[i][1])**2 + (self.R[j][2]-self.R[i][2])**2)
-        return out 
+        #nucleus-nucleus interaction, summed over all pairs i<j at once
+        R = np.array(self.R, dtype=float)
+        Z = np.array(self.Z, dtype=float)
+        i, j = np.triu_indices(self.Nz, k=1)
+        return float(np.sum(Z[i]*Z[j]/np.linalg.norm(R[j] - R[i], axis=1)))
 
     def computeOverlap(self, phi_orth = None):
         # if phi_orth == None:
@@ -256,40 +743,36 @@ class scfsolv:
             length = self.Norb
         else: 
             length = len(phi_orth)
-        S = np.zeros((length, length)) #Overlap matrix S_i,j = <Phi^i|Phi^j>
-        for i in range(length):
-            for j in range(i, length):
-                S[i,j] = vp.dot(phi_orth[i][-1], phi_orth[j][-1]) #compute the overlap of the current ([-1]) step
-                if i != j:
-                    S[j,i] = np.conjugate(S[i,j])
-        print(S)
+        #Overlap matrix S_i,j = <Phi^i|Phi^j> of the current ([-1]) step, upper triangle computed on the executor
+        S = ortho.overlapMatrix([phi_orth[i][-1] for i in range(length)], mapper=self.executor.map)
+        self.emit("overlap", lambda : {"S": S})
         return S
 
-    def orthonormalise(self, phi_in = None, normalise = True): #Lödwin orthogonalisation and normalisation
+    def orthonormalise(self, phi_in = None, normalise = True, method = None): #Lödwin (or Cholesky) orthogonalisation and normalisation
         if phi_in == None:
             phi_in = self.phi_prev
             length = self.Norb
         else: 
             length = len(phi_in)
+        if method is None:
+            method = self.orthoMethod
         S = self.computeOverlap(phi_in)
-        #Diagonalise S to compute S' := S^-1/2 
-        eigvals, U = np.linalg.eigh(S) #U is the basis change matrix
-
-        s = np.diag(np.power(eigvals, -0.5)) #diagonalised S 
-        #Compute s^-1/2
-        Sprime = np.dot(U,np.dot(s,np.transpose(U))) # S^-1/2 = U^dagger s^-1/2 U
-
-        print("U=", U)
+        phi_cur = [phi_in[j][-1] for j in range(length)]
+        #Nothing to do if the orbitals are already orthonormal within tolerance, the input trees are returned as they are
+        if ortho.isOrthonormal(S, self.orthoTol*self.prec):
+            return phi_cur
+        if method == "cholesky":
+            #Compute S' := L^-1, lower triangular
+            Sprime = ortho.choleskyMatrix(S)
+        else:
+            #Diagonalise S to compute S' := S^-1/2 
+            Sprime, U = ortho.lowdinMatrix(S)
+            self.emit("transform", lambda : {"U": U})
         #Apply S' to each orbital to obtain a new orthogonal element
-        phi_ortho = []
-        for i in range(length):
-            phi_tmp =  self.P_eps(utils.Fzero)
-            for j in range(length):
-            # for j in range(limit[i]):
-                phi_tmp = phi_tmp + Sprime[i,j]*phi_in[j][-1]
-            if normalise:
+        phi_ortho = utils.linComb(Sprime, phi_cur, self.prec, self.mra)
+        if normalise:
+            for phi_tmp in phi_ortho:
                 phi_tmp.normalize()
-            phi_ortho.append(phi_tmp)
         return phi_ortho
 
 
@@ -299,9 +782,12 @@ class scfsolv_1stpert(scfsolv):
     J1 : vp.FunctionTree                     #1st order perturbed Coulomb potential
     K1 : list                                #list of 1st order perturbed exchange potential applied to each orbital
     phi_prev1 : list                         #list of all 1st order perturbed orbitals and their KAIN history
+    kainGram1 : list                         #rolling KAIN inner products of every perturbed orbital
     f_prev1 : list                           #list of all 1st order perturbed orbitals updates and their KAIN history
     E1_n : list                              #list of perturbed orbital energies
     pertField : np.ndarray                   #Perturbative field in vector form
+    orb1Version : int                        #version counter of the perturbed orbitals and perturbation
+    pairCache : opcache.IterationCache       #unperturbed pair potentials, may be shared by the responses to the same ground state
     # mu : np.ndarray                          #Dipole moment
 
     # def __init__(self, prec, khist, lgdrOrder=6, sizeScale=-4, nboxes=2, scling=1.0) -> None: 
@@ -324,21 +810,36 @@ class scfsolv_1stpert(scfsolv):
         self.K1 = []
         self.phi_prev1 = []
         self.f_prev1 = []
+        self.kainGram1 = []
         self.pertField = np.zeros(3)
+        #The operator cache of the unperturbed solver must not be shared
+        self.orb1Version = 0
+        self.cache = opcache.IterationCache()
+        self.pairCache = opcache.IterationCache()
+        self.screenStats = {"pairs": 0, "skipped": 0}
+        self.observers = list(self.observers)
+        #The response iterations are counted and checkpointed separately
+        self.iteration = 0
+        self.checkpointer = None
+        #The perturbed density has its own incremental Coulomb state
+        self.coulombState = None
 
-    def init_molec(self, perturbativeField) -> None:
+    def init_molec(self, perturbativeField, Vpert = None) -> None: #Vpert can be given if the perturbation operator of perturbativeField is already projected
         self.pertField = perturbativeField
         # print("init_molec start")
         # self.Vpert = self.P_eps(lambda r : self.f_pert(r)) 
-        self.Vpert, mu = self.f_pert()
+        if Vpert is None:
+            Vpert, mu = self.f_pert()
+        self.Vpert = Vpert
         # print("Init_prout")
         #initial guesses can be zero for the perturbed orbitals
         self.phi_prev1 = []
-        print(f"=============Initial:")
         for i in range(self.Norb):
-            self.phi_prev1.append([self.P_eps(utils.Fzero)]) #TODO: faire en sorte que les perturbations soient dans les trois directions --> rajouer une couche de liste
+            self.phi_prev1.append(self.newHistory([self.P_eps(utils.Fzero)])) #TODO: faire en sorte que les perturbations soient dans les trois directions --> rajouer une couche de liste
         # self.f_prev1 = [[] for i in range(self.Norb)] #list of the corrections at previous steps
-        self.f_prev1 = [[] for i in range(self.Norb)] #list of the corrections at previous steps
+        self.f_prev1 = [self.newHistory() for i in range(self.Norb)] #list of the corrections at previous steps
+        self.kainGram1 = [KAIN.KainGram() for i in range(self.Norb)]
+        self.markPerturbedChanged()
         self.compFock()
         self.print_operators() 
 
@@ -385,11 +886,7 @@ class scfsolv_1stpert(scfsolv):
         # for i in range(len(self.phi_prev)):
         #     for j in range(len(self.phi_prev1)):
         #         print(f"Test: {i}, {j}", vp.dot(self.phi_prev[i][-1], self.phi_prev1[j][-1]))
-        pert_mat = np.zeros((self.Norb,self.Norb))
-        for i in range(len(self.phi_prev)):
-            for j in range(len(self.phi_prev)):
-                pert_mat[i,j] =  vp.dot(self.phi_prev[i][-1], self.Vpert * self.phi_prev[j][-1])
-        print("pert_mat : ",pert_mat)
+        self.diagnostic("pert_mat : ", lambda : np.array([[vp.dot(self.phi_prev[i][-1], self.Vpert * self.phi_prev[j][-1]) for j in range(self.Norb)] for i in range(self.Norb)]))
         # print(f"=============Iteration: 1")
         # self.print_operators()     
 
@@ -397,21 +894,14 @@ class scfsolv_1stpert(scfsolv):
         #Compute the fock matrix of the system
         self.compFock()
         
-        phistory = []
         self.E1_n = []
         # norm = []
         update = []
         for orb in range(self.Norb):
             self.E1_n.append(self.Fock1[orb, orb])
-            #Compute new power iteration for the Helmholtz operator
-            phi_np1 = self.powerIter(orb) 
-            # print("Test orthogonalité de phi_np1 p.r. aux orbitals du GS: ")
-            # for orbtmp in range(self.Norb):
-            #     vp.dot(phi_np1, self.phi_prev[orbtmp][-1]))       
-            #create an alternate history of orbitals which include the power iteration
-            phistory.append([phi_np1]) #may be bugged
-            # phistory.append(phi_np1) #debug
-            # self.f_prev1[orb].append(phistory[orb][-1] - self.phi_prev1[orb][-1])
+        #Compute new power iteration for the Helmholtz operator
+        #create an alternate history of orbitals which include the power iteration
+        phistory = [[phi_np1] for phi_np1 in self.powerIterAll()] #may be bugged
 
         # Orthogonalise the alternate orbital history w.r.t. the unperturbed orbital
         phistory = self.orthogonalise(phistory) #may be bugged
@@ -435,120 +925,95 @@ class scfsolv_1stpert(scfsolv):
             if len(self.phi_prev1[orb]) > self.khist: #deleting oldest element to save memory
                 del self.phi_prev1[orb][0]
                 del self.f_prev1[orb][0]
+        self.markPerturbedChanged()
         
         self.print_operators()
         return np.array(self.E1_n),  np.array(update)
     
     def expandSolution(self):
-        print("Pouet la girouette --------------------------------")
         # Orthogonalise the alternate orbital history w.r.t. the unperturbed orbital in case they aren't yet
         # phi_ortho = self.orthogonalise()
         # for orb in range(self.Norb): #Mandatory loop due to questionable data format choice.
         #     self.phi_prev1[orb][-1] = phi_ortho[orb]
+        self.prepareStep()
+        #Compute new power iteration for the Helmholtz operator
+        # print("Test orthogonalité de phi_np1 p.r. aux orbitals du GS: ")
+        # for orbtmp in range(self.Norb):
+        #     vp.dot(phi_np1, self.phi_prev[orbtmp][-1]))       
+        return self.completeStep(self.powerIterAll())
 
+    def prepareStep(self): #Fock matrix and energies needed by the Helmholtz arguments of the iteration
         #Compute the fock matrix of the system
         self.compFock()
-        
-        phistory = []
         self.E1_n = []
-        # norm = []
-        update = []
         for orb in range(self.Norb):
             self.E1_n.append(self.Fock1[orb, orb])
-            #Compute new power iteration for the Helmholtz operator
-            phi_np1 = self.powerIter(orb) 
-            # print("Test orthogonalité de phi_np1 p.r. aux orbitals du GS: ")
-            # for orbtmp in range(self.Norb):
-            #     vp.dot(phi_np1, self.phi_prev[orbtmp][-1]))       
-            #create an alternate history of orbitals which include the power iteration
-            phistory.append([phi_np1]) #may be bugged
-            # phistory.append(phi_np1) #debug
-            # self.f_prev1[orb].append(phistory[orb][-1] - self.phi_prev1[orb][-1])
-
-        print("TEST expandSol: before Orthogonalize")
-        for i in range(len(self.phi_prev)):
-            for j in range(len(self.phi_prev1)):
-                print(f"Test: {i}, {j}", vp.dot(self.phi_prev[i][-1], phistory[j][-1]))
-                print(f"Test self phistory", vp.dot(phistory[i][-1], phistory[j][-1]))
+
+    def completeStep(self, phi_np1): #KAIN step from the power iterations phi_np1 of every orbital
+        #create an alternate history of orbitals which include the power iteration
+        phistory = [[phi] for phi in phi_np1] #may be bugged
+
+        self.diagnostic("TEST expandSol: before Orthogonalize <phi_i|phistory_j>", lambda : self.overlapTest([phi[-1] for phi in phistory]))
         # Orthogonalise the alternate orbital history w.r.t. the unperturbed orbital
         phistory = self.orthogonalise(phistory) #may be bugged
-        print("TEST expandSol: AFTER Orthogonalize")
-        for i in range(len(self.phi_prev)):
-            for j in range(len(self.phi_prev1)):
-                print(f"Test: {i}, {j}", vp.dot(self.phi_prev[i][-1], phistory[j]))
-                print(f"Test self phistory", vp.dot(phistory[i], phistory[j]))
+        self.diagnostic("TEST expandSol: AFTER Orthogonalize <phi_i|phistory_j>", lambda : self.overlapTest(phistory))
 
         for orb in range(self.Norb):
             # print("check norme phistory",vp.dot(phistory[orb],phistory[orb]))
             # phistory[orb] = -1*phistory[orb]
-            self.f_prev1[orb].append(phistory[orb] - self.phi_prev1[orb][-1])
+            self.f_prev1[orb].append(self.cropTree(phistory[orb] - self.phi_prev1[orb][-1]))
             #Setup and solve the linear system Ac=b
             # c = self.setuplinearsystem(orb) 
 
-        print("lenght of current history", len(self.phi_prev1[orb]), len(self.f_prev1[orb]))
+        self.diagnostic("lenght of current history", lambda : (len(self.phi_prev1[orb]), len(self.f_prev1[orb])))
         c = self.setuplinearsystem_all() #TODO: problème ici, c'est pas la même chose que dans MRCHem
-        print("Coefficients c:", c)
+        self.diagnostic("Coefficients c:", lambda : c)
         
         # # test to see if the initial step is needed #new way
         # if len(self.phi_prev1[orb]) <= self.khist: #new way
         #     c = np.concatenate(([1.0],c)) #new way
         # print(c) #new way
         # phi_n_ortho = [] #wrong
-        for orb in range(self.Norb):
-            # #Compute the correction delta to the orbitals #new way
-            # delta = self.f_prev[orb][-1]#new way #The c[0]=1 coefficient is implicit here
-            # # delta = self.P_eps(utils.Fzero)
-            # print("update")
-            # for j in range(len(self.phi_prev1[orb])): #new way
-            #     delta = delta + c[j]*(self.phi_prev1[orb][j] - self.phi_prev1[orb][-1] + self.f_prev1[orb][j] - self.f_prev1[orb][-1]) #new way
-
-            # old way, probably correct
-            #Compute the correction delta to the orbitals 
-            delta = self.f_prev1[orb][-1] #The c[0]=1 coefficient is implicit here
-            # delta = self.P_eps(utils.Fzero)
-            print("superupdate")
-            for j in range(len(c)):
-                print("tut")
-                delta = delta + c[j]*(self.phi_prev1[orb][j] - self.phi_prev1[orb][-1] + self.f_prev1[orb][j] - self.f_prev1[orb][-1])
-            
-            #Apply correction
-            phi_n = self.phi_prev1[orb][-1]
-            phi_n = phi_n + delta
-            print("Orthogonality of phi_n", vp.dot(phi_n, self.phi_prev[orb][-1]))
-        #     phi_n_ortho.append([phi_n]) #wrong
-        # phi_n_ortho = self.orthogonalise(phi_n_ortho)  #wrong
-        # print("ExpandSol: trying phi_n orthogonalised")
-        # for orb in range(self.Norb):  #wrong #Mandatory loop due to questionable data format choice.
-            # self.phi_prev1[orb][-1] = phi_ortho[orb]
-            # #Normalize
-            # norm.append(phi_n.norm())
-            # phi_n.normalize()
-            #Save new orbital
-            # self.phi_prev1[orb].append(phi_n_ortho[orb]) #wrong
-            self.phi_prev1[orb].append(phi_n) #Right
-            #Correction norm (convergence metric)
-            update.append(delta.norm())
-            if len(self.phi_prev1[orb]) > self.khist: #deleting oldest element to save memory
-                del self.phi_prev1[orb][0]
-                del self.f_prev1[orb][0]
+        #The corrections share the coefficients c but are otherwise independent across orbitals
+        update = self.executor.map(lambda orb : self.correctOrbital(orb, c), range(self.Norb))
+        self.markPerturbedChanged()
         
         self.print_operators()
         return np.array(self.E1_n),  np.array(update)
 
+    def correctOrbital(self, orb, c): #KAIN correction of one perturbed orbital, only touches the history of orb
+        # #Compute the correction delta to the orbitals #new way
+        # delta = self.f_prev[orb][-1]#new way #The c[0]=1 coefficient is implicit here
+        # # delta = self.P_eps(utils.Fzero)
+        # print("update")
+        # for j in range(len(self.phi_prev1[orb])): #new way
+        #     delta = delta + c[j]*(self.phi_prev1[orb][j] - self.phi_prev1[orb][-1] + self.f_prev1[orb][j] - self.f_prev1[orb][-1]) #new way
+
+        # old way, probably correct
+        #Compute the correction delta to the orbitals 
+        delta = self.kainDelta(self.phi_prev1[orb], self.f_prev1[orb], c) #The c[0]=1 coefficient is implicit here
+        
+        #Apply correction
+        phi_n = self.phi_prev1[orb][-1]
+        phi_n = self.cropTree(phi_n + delta)
+        self.diagnostic("Orthogonality of phi_n", lambda : vp.dot(phi_n, self.phi_prev[orb][-1]))
+        #Save new orbital
+        self.phi_prev1[orb].append(phi_n) #Right
+        #Correction norm (convergence metric)
+        update = delta.norm()
+        if len(self.phi_prev1[orb]) > self.khist: #deleting oldest element to save memory
+            del self.phi_prev1[orb][0]
+            del self.f_prev1[orb][0]
+        return update
+
     def setuplinearsystem(self,orb):
-        lenHistory = len(self.phi_prev1[orb])-1
-        # Compute matrix A
-        A = np.zeros((lenHistory, lenHistory))
-        b = np.zeros(lenHistory)
-        for l in range(lenHistory):  
-            dPhi = self.phi_prev1[orb][l] - self.phi_prev1[orb][-1]
-            b[l] = vp.dot(dPhi, self.f_prev1[orb][-1])
-            for j in range(lenHistory):
-                A[l,j] = -vp.dot(dPhi, self.f_prev1[orb][j] - self.f_prev1[orb][-1])
+        # Compute matrix A and vector b from the rolling inner products <phi_l|f_j>
+        G = self.kainGram1[orb].update(self.phi_prev1[orb], self.f_prev1[orb])
+        A, b = KAIN.kainLinearSystem(G)
         # #solve Ac = b for c
-        print("Norm last phi", orb, len(self.phi_prev1[orb]), vp.dot(self.phi_prev1[orb][-1],self.phi_prev1[orb][-1] ))
-        print("Norm last f", orb, len(self.f_prev1[orb]), vp.dot(self.f_prev1[orb][-1],self.f_prev1[orb][-1] ))
-        print("Système linéraire: A= ", A, "b = ",b)
+        self.diagnostic("Norm last phi", lambda : (orb, len(self.phi_prev1[orb]), vp.dot(self.phi_prev1[orb][-1],self.phi_prev1[orb][-1] )))
+        self.diagnostic("Norm last f", lambda : (orb, len(self.f_prev1[orb]), vp.dot(self.f_prev1[orb][-1],self.f_prev1[orb][-1] )))
+        self.diagnostic("Système linéraire:", lambda : {"A": A, "b": b})
         # c = np.linalg.solve(A, b)
         # return c
         return A, b
@@ -562,7 +1027,7 @@ class scfsolv_1stpert(scfsolv):
             A = A + Aorb
             b = b + borb
         #solve Ac = b for c
-        print("Système linéraire final: A= ", A, "b = ",b)
+        self.diagnostic("Système linéraire final:", lambda : {"A": A, "b": b})
         c = []
         if b.size > 0:
             c = np.linalg.solve(A, b)
@@ -570,61 +1035,129 @@ class scfsolv_1stpert(scfsolv):
 
     def scfRun(self, thrs = 1e-3, printVal = False, pltShow = False):
         update = np.ones(self.Norb)
-        norm = np.zeros(self.Norb)
+        runObservers = observers.fromFlags(printVal, pltShow)
+        self.observers.extend(runObservers)
         #iteration counter
         iteration = 1
         # Optimization loop (KAIN) #TODO continuer
-        while update.max() > thrs and iteration < 10:
-            print(f"=============Iteration: {iteration}")
-            iteration += 1 
-            if self.khist == 0:
-                self.E1_n, update = self.expandSolution_nokain()
-            else:
-                self.E1_n, update = self.expandSolution()
-            # print("TEST run")
-            # for i in range(len(self.phi_prev)):
-            #     for j in range(len(self.phi_prev1)):
-            #         print(f"Test: {i}, {j}", vp.dot(self.phi_prev[i][-1], self.phi_prev1[j][-1]))
-            for orb in range(self.Norb):
-                # this will plot the wavefunction at each iteration
-                r_x = np.linspace(-5., 5., 1000)
-                phi_n_plt = [self.phi_prev[orb][-1]([x, 0.0, 0.0]) for x in r_x]
-                plt.plot(r_x, phi_n_plt) 
-                if printVal:
-                    print(f"Orbital: {orb}    Norm: {norm}    Update: {update}    Energy:{self.E1_n}")
-        if pltShow:
-            plt.show()
+        try:
+            while update.max() > thrs and iteration < 10:
+                start = time.perf_counter()
+                if self.khist == 0:
+                    self.E1_n, update = self.expandSolution_nokain()
+                else:
+                    self.E1_n, update = self.expandSolution()
+                elapsed = time.perf_counter() - start
+                self.manageMemory()
+                self.iteration += 1
+                self.saveCheckpoint()
+                self.emit("iteration", lambda : {"iteration": iteration, "energies": self.E1_n, "norms": None, "updates": update, "time": elapsed})
+                iteration += 1 
+                # print("TEST run")
+                # for i in range(len(self.phi_prev)):
+                #     for j in range(len(self.phi_prev1)):
+                #         print(f"Test: {i}, {j}", vp.dot(self.phi_prev[i][-1], self.phi_prev1[j][-1]))
+            self.emit("finish", lambda : {"iterations": iteration - 1})
+            self.saveCheckpoint(force=True)
+            if self.checkpointer is not None:
+                self.checkpointer.wait()
+        finally:
+            for obs in runObservers:
+                self.removeObserver(obs)
+        return iteration - 1
+
+    def checkpointState(self): #The response checkpoints also contain the unperturbed state
+        state = super().checkpointState()
+        state["values"]["kind"] = "scfsolv_1stpert"
+        state["values"]["pertField"] = np.asarray(self.pertField, dtype=float).tolist()
+        state["arrays"].update({"Fock1": self.Fock1, "E1_n": np.array(self.E1_n)})
+        state["trees"].update({"phi_prev1": [list(hist) for hist in self.phi_prev1], "f_prev1": [list(hist) for hist in self.f_prev1]})
+        return state
+
+    def restoreState(self, state):
+        if state["values"]["kind"] != "scfsolv_1stpert":
+            raise ValueError(f"Cannot resume a response run from a {state['values']['kind']} checkpoint")
+        super().restoreState(state)
+        self.pertField = np.array(state["values"]["pertField"])
+        self.Vpert, mu = self.f_pert()
+        self.phi_prev1 = [self.newHistory(hist) for hist in state["trees"]["phi_prev1"]]
+        self.f_prev1 = [self.newHistory(hist) for hist in state["trees"]["f_prev1"]]
+        self.kainGram1 = [KAIN.KainGram() for i in range(self.Norb)]
+        self.Fock1 = state["arrays"]["Fock1"]
+        self.E1_n = list(state["arrays"]["E1_n"])
+        self.markPerturbedChanged()
+
+    def useHistoryStore(self, budgetMB, directory = None): #The store is shared with the unperturbed histories
+        super().useHistoryStore(budgetMB, directory)
+        self.phi_prev1 = [self.newHistory(hist) for hist in self.phi_prev1]
+        self.f_prev1 = [self.newHistory(hist) for hist in self.f_prev1]
+        self.kainGram1 = [KAIN.KainGram() for i in range(len(self.kainGram1))]
+
+    def setPrecision(self, prec): #The perturbation operator depends on the precision too
+        if prec == self.prec:
+            return
+        super().setPrecision(prec)
+        if np.linalg.norm(self.pertField) > 0:
+            self.Vpert, mu = self.f_pert()
+        self.markPerturbedChanged()
+
+    def memoryGroups(self): #The unperturbed trees belong to the ground state solver, they are counted but not cropped
+        #Vpert may be one of the cached dipole operators of properties, it is not cropped either
+        ground = super().memoryGroups()
+        return {"orbitals": [hist[-1] for hist in self.phi_prev1],
+                "histories": [tree for hist in self.phi_prev1 + self.f_prev1 for tree in history.residentTrees(hist)],
+                "potentials": [self.J1] + list(self.K1),
+                "shared": ground["histories"] + ground["potentials"] + ground["shared"] + [self.Vpert]}
+
+    def markCropped(self):
+        self.markPerturbedChanged()
+        for gram in self.kainGram1:
+            gram.reset()
+
+    #Operator cache
+    def markPerturbedChanged(self): #Must be called whenever the perturbed orbitals or the perturbation are modified
+        self.orb1Version += 1
+
+    def stateVersion(self):
+        return (self.orbVersion, self.orb1Version)
+
+    def cacheStats(self):
+        stats = super().cacheStats()
+        stats["pairs"] = self.pairCache.stats()
+        return stats
         
     #computation of operators
     def compFock(self): 
+        version = self.stateVersion()
+        cached = self.cache.get("fock1", version)
+        if cached is not None:
+            self.Fock1, self.J1, self.K1 = cached
+            return
         self.Fock1 = np.zeros((self.Norb, self.Norb))
-        self.K1 = []
-        self.J1 = self.computeCoulombPot()
+        self.J1 = self.cropTree(self.computeCoulombPot())
+        #Compute the perturbed exchange potential applied to every orbital at once
+        self.K1 = [self.cropTree(K_i) for K_i in self.computeExchangePotentials()]
         for j in range(self.Norb):
-            #Compute the potential operator
-            self.K1.append(self.computeExchangePotential(j))
             # V = Vnuc
             # compute the energy from the orbitals 
             Fphi = self.compFop(j)
             for i in range(self.Norb):
                 self.Fock1[j,i] = vp.dot(self.phi_prev[i][-1], Fphi)
+        self.cache.store("fock1", version, (self.Fock1, self.J1, self.K1))
 
-    def compFop(self, orb): #Computes the Fock operator applied to an orbital orb
+    def applyFock(self, orb): #Computes the Fock operator applied to an orbital orb
         Fphi = self.Vpert*self.phi_prev[orb][-1] + self.J1*self.phi_prev[orb][-1] - self.K1[orb]
         return Fphi
     
     def compScalarPrdt(self, orb1, orb2 ):
         # print("comp Rho", orb1, orb2)
         # print(len(self.phi_prev), len(self.phi_prev1))
-        rho = (self.phi_prev[orb1][-1]*self.phi_prev1[orb2][-1] + self.phi_prev1[orb1][-1]*self.phi_prev[orb2][-1])
+        rho = (self.phi_prev[orb1][-1]*self.phi_prev1[orb2][-1] + self.conjugateOrbital(orb1)*self.phi_prev[orb2][-1])
         return rho
 
-    def computeCoulombPot(self): 
-        PNbr = 4*np.pi*self.compScalarPrdt(0,0)
-        for orb in range(1, self.Norb):
-            PNbr = PNbr + 4*np.pi*self.compScalarPrdt(orb,orb)
-        return self.Pois(2*PNbr) #factor of 2 because we sum over the number of orbitals, not electrons
-    
+    def conjugateOrbital(self, orb): #Perturbed orbital paired with phi_prev1 in the density, itself in the static case
+        return self.phi_prev1[orb][-1]
+
     def computeExchangePotential(self, idx):
         K_idx = self.phi_prev[0][-1]*self.Pois(4*np.pi*self.phi_prev1[0][-1]*self.phi_prev[idx][-1]) + self.phi_prev1[0][-1]*self.Pois(4*np.pi*self.phi_prev[0][-1]*self.phi_prev[idx][-1])
         # print("COMPUTE K_idx (1): ", vp.dot(self.phi_prev[1][-1],K_idx))
@@ -632,14 +1165,55 @@ class scfsolv_1stpert(scfsolv):
             K_idx = K_idx + self.phi_prev[j][-1]*self.Pois(4*np.pi*self.phi_prev1[j][-1]*self.phi_prev[idx][-1]) + self.phi_prev1[j][-1]*self.Pois(4*np.pi*self.phi_prev[j][-1]*self.phi_prev[idx][-1])
         # print("COMPUTE K_idx (2): ", vp.dot(self.phi_prev[0][-1],self.Pois(4*np.pi*self.compScalarPrdt(idx,1))*self.phi_prev[1][-1]))
         return K_idx 
+
+    def computeExchangePotentials(self): #Computes K^1_idx for every orbital; the unperturbed pair potentials P[phi_j*phi_idx] are computed once per pair
+        phi = [self.phi_prev[i][-1] for i in range(self.Norb)]
+        phi1 = [self.phi_prev1[i][-1] for i in range(self.Norb)]
+        conj = [self.conjugateOrbital(i) for i in range(self.Norb)]
+        K = []
+        #Perturbed pair potentials P[phi^1_j*phi_idx] are not symmetric and are computed for every (j, idx)
+        norms1 = self.pairNorms(conj, phi)
+        for idx in range(self.Norb):
+            K_idx = None
+            for j in range(self.Norb):
+                if not self.screenPair(norms1, j, idx):
+                    K_idx = addTerm(K_idx, phi[j]*self.computePairPotential(conj[j], phi[idx]))
+            K.append(K_idx)
+        self.recordScreening(norms1)
+        #Unperturbed pair potentials V_j,idx = V_idx,j contribute phi^1_j*V_j,idx to K^1_idx and phi^1_idx*V_j,idx to K^1_j
+        #They only depend on the unperturbed orbitals and are kept for the whole response run
+        norms0 = self.unperturbedPairNorms()
+        for idx in range(self.Norb):
+            V_ii = self.unperturbedPairPotential(idx, idx)
+            K[idx] = addTerm(K[idx], phi1[idx]*V_ii)
+            for j in range(idx+1, self.Norb):
+                if self.screenPair(norms0, j, idx):
+                    continue
+                V_ij = self.unperturbedPairPotential(j, idx)
+                K[idx] = K[idx] + phi1[j]*V_ij
+                K[j] = addTerm(K[j], phi1[idx]*V_ij)
+        self.recordScreening(norms0, [(j, idx) for idx in range(self.Norb) for j in range(idx+1, self.Norb)])
+        return K
+
+    def unperturbedPairNorms(self): #Relative ||phi_i*phi_j|| of the unperturbed orbitals, cached with the pair potentials
+        if self.exchangeScreen is None:
+            return None
+        return self.pairCache.lookup(("norms0",), (self.orbVersion,), lambda : self.pairNorms([self.phi_prev[i][-1] for i in range(self.Norb)]))
+
+    def unperturbedPairPotential(self, i, j): #P[phi_i*phi_j], cached until the unperturbed orbitals change
+        i, j = min(i, j), max(i, j)
+        return self.pairCache.lookup(("V0", i, j), (self.orbVersion,), lambda : self.computePairPotential(self.phi_prev[i][-1], self.phi_prev[j][-1]))
     
     def computeUnperturbedExchangePotential(self, idx):
-        K_idx = self.phi_prev[0][-1]*self.Pois(4*np.pi*self.phi_prev[0][-1]*self.phi_prev1[idx][-1])
+        norms = self.pairNorms([self.phi_prev[j][-1] for j in range(self.Norb)], [self.phi_prev1[idx][-1]])
+        K_idx = None
         # print("COMPUTE K_idx (1): ", vp.dot(self.phi_prev[1][-1],K_idx))
-        for j in range(1, self.Norb): #summing over occupied orbitals
-            K_idx = K_idx + self.phi_prev[j][-1]*self.Pois(4*np.pi*self.phi_prev[j][-1]*self.phi_prev1[idx][-1])
+        for j in range(self.Norb): #summing over occupied orbitals
+            if not self.screenPair(norms, j, 0):
+                K_idx = addTerm(K_idx, self.phi_prev[j][-1]*self.Pois(4*np.pi*self.phi_prev[j][-1]*self.phi_prev1[idx][-1]))
         # print("COMPUTE K_idx (2): ", vp.dot(self.phi_prev[0][-1],self.Pois(4*np.pi*self.compScalarPrdt(idx,1))*self.phi_prev[1][-1]))
-        return K_idx 
+        self.recordScreening(norms)
+        return self.zeroIfNone(K_idx)
 
     def powerIter_old(self, orb): #TODO: Probablement un problème dans le (1-rho0) 
         # if order == 1:
@@ -664,16 +1238,13 @@ class scfsolv_1stpert(scfsolv):
 
         #Compute K^0 |phi^1>
         K0phi1 = self.computeUnperturbedExchangePotential(orb)
-        print("Test perturbed space", orb, vp.dot(Fphi - rhoFphi, self.phi_prev[orb][-1]))
+        self.diagnostic("Test perturbed space", lambda : (orb, vp.dot(Fphi - rhoFphi, self.phi_prev[orb][-1])))
         return -2*self.G_mu[orb](self.Vnuc*self.phi_prev1[orb][-1] + self.J*self.phi_prev1[orb][-1] - K0phi1 - phi_ortho + Fphi - rhoFphi) 
     
-    def powerIter(self, orb): #Devrait suivre la méthode qu'utilise MRChem plus précisément
-        phi_ortho = self.P_eps(utils.Fzero)
-        #Take into account the non-canonical constraint Sum_{j≠i} F^0_ij|phi^1_{j}>
-        for j in range(self.Norb): 
-            # phi_ortho = phi_ortho + self.Fock[0][orb, j]*self.phi_prev[j][-2][1] 
-            if j != orb:
-                phi_ortho = phi_ortho + self.Fock[orb, j]*self.phi_prev1[j][-1] 
+    def helmholtzArgument(self, orb): #Devrait suivre la méthode qu'utilise MRChem plus précisément
+        #Take into account the non-canonical constraint Sum_{j≠i} F^0_ij|phi^1_{j}>, added to the final linear combination
+        #The diagonal term is the shift of the quantized Helmholtz operator, see scfsolv.helmholtzShift
+        ortho_coefs = [-self.Fock[orb, j] if j != orb else self.helmholtzShift(orb) for j in range(self.Norb)]
         Fphi = self.orthogonalise([[self.compFop(orb)]])[0] #the 0 index here is necessary because compFop returns a one-element list of fctTree
 
         # print("test phi ortho",vp.dot(phi_ortho, self.phi_prev1[orb][-1]))
@@ -703,75 +1274,52 @@ class scfsolv_1stpert(scfsolv):
         # print("Test to see which one is messing everything up: J", orb, vp.dot(self.J*self.phi_prev1[orb][-1] , self.J*self.phi_prev1[orb][-1] ))
         # print("Test to see which one is messing everything up: K", orb, vp.dot(K0phi1 , K0phi1 ))
         # print("Test to see which one is messing everything up: phi_ortho", orb, vp.dot(phi_ortho , phi_ortho ))
-        return -2*self.G_mu[orb](self.Vnuc*self.phi_prev1[orb][-1] + self.J*self.phi_prev1[orb][-1] - K0phi1 - phi_ortho + Fphi)
-        # return -2*self.G_mu[orb](Fphi) 
+        #(Vnuc + J)phi^1_i - K^0 phi^1_i - Sum_{j≠i} F^0_ij phi^1_j + Q F^1 phi_i + shift*phi^1_i, as a single linear combination
+        coefs = [1., -1., 1.] + ortho_coefs
+        trees = [(self.Vnuc + self.J)*self.phi_prev1[orb][-1], K0phi1, Fphi] + [self.phi_prev1[j][-1] for j in range(self.Norb)]
+        return utils.linCombOne(coefs, trees, self.prec, self.mra)
+        # return Fphi
     
     #Dipole moment and polarisability computation
-    def compDiMo(self, drct = 0, nuclei_width = 0): #computes the dipole moment operator
-        #The electron contribution to the dipole moment is only a position operator
-        r_i = self.P_eps(lambda r : utils.Flin(r, drct))
-        electronContrib = -1*r_i #charge of an e- is -1
-        
-        # print("Bidoumpf le schtroumpf")
-        #Computing nuclear contribution (Greatly inspired by Gabriel's 'constructChargeDensity' function in MRPyCM)
-        nucContrib = vp.GaussExp() #creates a sum of Gaussian, treated like a list/array
-        if nuclei_width <= 0: 
-            nuclei_width = self.prec #The standard deviation of the Gaussian functions are of the same order of magnitude as the precision, as they effectively represent point charges
-        for nuc in range(len(self.Z)):
-            # print("Paf le taf")
-            norm_factor = (nuclei_width / np.pi)**(3./2.) #Gaussian normalisation factor. 'nuclei_width' is the exponent factor of the Gaussians 
-            # print("schplonk le tonk")
-            nucContrib.append(vp.GaussFunc(exp=nuclei_width, coef=norm_factor*self.Z[nuc], pos=self.R[nuc], pow=[0,0,0]))
-        # print("wabadubdub")
-        return electronContrib + self.P_eps(nucContrib), electronContrib, nucContrib
+    def compDiMo(self, drct = 0): #computes the dipole moment operator
+        #The operator acting on the electrons is -r_i, cached for the MRA and precision by properties
+        #The nuclear contribution Sum_a Z_a R_a,i is a constant, it is computed analytically instead of projected
+        electronContrib = properties.dipoleOperators(self)[drct]
+        nucContrib = properties.nuclearDipole(self.R, self.Z)[drct]
+        return electronContrib, electronContrib, nucContrib
 
     #Utilities
-    def f_pert(self) -> tuple:   #TODO: Corriger le fait que ça retourne un float plutôt qu'un functiontree
-        #The perturbative field contribution to the energy is of the form $-\vec{\mu}\cdot\vec{\epsilon}$ 
-        out = self.P_eps(utils.Fzero) #dipole moment
-        #This loop is basically a scalar product between epsilon (represented by self.pertField) and the dipole moment mu
-        mu = [0 for i in range(3)]
-        for direction in range(3): #3 directions: x,y and z
-            # computing the current component of the dipole moment
-            print("Tutututtutututututututut", len(mu))
-            mu[direction], muEl, muNuc = self.compDiMo(drct=direction, nuclei_width=0)
-            # print(f"mu_{direction} = ", mu[direction])
-            # computing the scalar product
-            out = out + self.pertField[direction] * mu[direction] / np.linalg.norm(self.pertField)
-        return out, (mu, muEl, muNuc)
+    def f_pert(self) -> tuple:
+        #The perturbative field contribution to the energy is of the form $-\vec{\mu}\cdot\vec{\epsilon}$, built in a single addition pass
+        mu = properties.dipoleOperators(self)
+        out = utils.linCombOne(np.array(self.pertField)/np.linalg.norm(self.pertField), mu, self.prec, self.mra)
+        return out, (mu, mu, properties.nuclearDipole(self.R, self.Z))
   
     def computeOverlap(self, phi_in = None): #Computes the overlap between phi_in and the unperturbed orbitals
         # return super().computeOverlap(phi_orth)
         if phi_in == None:
             phi_in = self.phi_prev1
-        S = np.zeros((self.Norb, self.Norb)) #Overlap matrix S_i,j = <Phi^i|Phi^j>
-        for i in range(len(phi_in)):
-            for j in range(self.Norb):
-                S[i,j] = vp.dot(self.phi_prev[j][-1], phi_in[i][-1]) #compute the overlap of the current ([-1]) step
-        return S
+        #Overlap matrix S_i,j = <Phi^i|Phi^0_j> of the current ([-1]) step
+        return ortho.overlapMatrix([phi[-1] for phi in phi_in], [self.phi_prev[j][-1] for j in range(self.Norb)], mapper=self.executor.map)
     
     def orthogonalise(self, phi_in = None): #Gram-Schmidt orthogonalisation
         if phi_in == None:
             phi_in = self.phi_prev1
         S = self.computeOverlap(phi_in)
-        #Apply S' to each orbital to obtain a new orthogonal element
+        #phi_i - Sum_j S_ij phi^0_j for every input, each built in a single pass
         phi_ortho = []
         for i in range(len(phi_in)):
-            # phi_tmp =  self.P_eps(utils.Fzero)
-            phi_tmp =  phi_in[i][-1]
-            for j in range(self.Norb):
-            # for j in range(limit[i]):
-                phi_tmp = phi_tmp - S[i,j]*self.phi_prev[j][-1]
-            # if normalise:
-            #     phi_tmp.normalize()
-            phi_ortho.append(phi_tmp)
+            coefs = np.concatenate(([1.], -S[i]))
+            phi_ortho.append(utils.linCombOne(coefs, [phi_in[i][-1]] + [self.phi_prev[j][-1] for j in range(self.Norb)], self.prec, self.mra))
         return phi_ortho
 
-    def print_operators(self):
+    def print_operators(self): #Only does work if an observer wants diagnostics
+        if not any(obs.wants("diagnostic") for obs in self.observers):
+            return
         self.compFock()
         coulomb = np.zeros((self.Norb,self.Norb))
         exchange = np.zeros((self.Norb,self.Norb))
-        # correlation = np.zeros((2,2))
+        correlation = np.zeros((self.Norb,self.Norb))
         for orb1 in range(self.Norb):
             J1phi0 = self.J1*self.phi_prev[orb1][-1]
             for orb2 in range(self.Norb):
@@ -780,7 +1328,67 @@ class scfsolv_1stpert(scfsolv):
                 # print("Perturbed Potentials' expectation values: ", orb2, orb1)
                 # print("Coulomb", vp.dot(self.phi_prev[orb2][-1], J1phi0))
                 # print("Exchange", vp.dot(self.phi_prev[orb2][-1], self.K1[orb1]))
-                print("correlation", vp.dot(self.phi_prev[orb2][-1], self.phi_prev[orb1][-1]), vp.dot(self.phi_prev[orb1][-1], self.phi_prev[orb2][-1]))
-        print("Fock", self.Fock1)
-        print("Coulomb", coulomb)
-        print("Exchange", exchange)
+                correlation[orb1,orb2] = vp.dot(self.phi_prev[orb2][-1], self.phi_prev[orb1][-1])
+        self.diagnostic("correlation", lambda : correlation)
+        self.diagnostic("Fock", lambda : self.Fock1)
+        self.diagnostic("Coulomb", lambda : coulomb)
+        self.diagnostic("Exchange", lambda : exchange)
+
+    def overlapTest(self, phi_in): #<phi_i|phi_in_j> and <phi_in_i|phi_in_j>, used by the orthogonality diagnostics
+        return {"unperturbed": np.array([[vp.dot(self.phi_prev[i][-1], phi_in[j]) for j in range(len(phi_in))] for i in range(self.Norb)]),
+                "self": np.array([[vp.dot(phi_in[i], phi_in[j]) for j in range(len(phi_in))] for i in range(len(phi_in))])}
+
+
+class scfsolv_dynpert(scfsolv_1stpert):
+    """
+    One component of the frequency-dependent response at frequency omega: x (omega > 0) or y (omega < 0).
+    The x and y components are coupled through the perturbed density phi*x + y*phi and the exchange, each component
+    is the partner of the other. With omega = 0, x = y and the equations are those of scfsolv_1stpert.
+    The orbitals are iterated with the shifted Helmholtz operators G_mu, mu = sqrt(-2*(E_i + omega)), taken from the
+    Helmholtz cache of the ground state so that they are shared with every other response at the same frequency.
+    The components are meant to be driven by response.DynamicResponse.
+    """
+    omega : float                            #frequency of the component, negative for y
+    partner : "scfsolv_dynpert"              #the other component
+
+    def __init__(self, ground, omega) -> None:
+        super().__init__(ground)
+        self.partner = self
+        self.setFrequency(omega)
+
+    def setFrequency(self, omega):
+        for E in self.E_n:
+            if E + omega >= 0:
+                raise ValueError(f"Frequency {omega} is above the excitation threshold of an orbital of energy {E}")
+        self.omega = omega
+        #Own list, the ground state one is shared
+        self.G_mu = [self.helmholtz.get(self.mra, np.sqrt(-2*self.helmholtzEnergy(orb)), self.prec) for orb in range(self.Norb)]
+        self.markPerturbedChanged()
+
+    def setPrecision(self, prec):
+        if prec == self.prec:
+            return
+        super().setPrecision(prec)
+        self.setFrequency(self.omega)
+
+    def init_molec(self, perturbativeField, Vpert = None, guess = None) -> None: #guess are the starting perturbed orbitals, zero by default
+        self.pertField = perturbativeField
+        if Vpert is None:
+            Vpert, mu = self.f_pert()
+        self.Vpert = Vpert
+        if guess is None:
+            guess = [self.P_eps(utils.Fzero) for i in range(self.Norb)]
+        #No initial step here, it needs the partner component to be initialised too
+        self.phi_prev1 = [self.newHistory([guess[i]]) for i in range(self.Norb)]
+        self.f_prev1 = [self.newHistory() for i in range(self.Norb)]
+        self.kainGram1 = [KAIN.KainGram() for i in range(self.Norb)]
+        self.markPerturbedChanged()
+
+    def helmholtzEnergy(self, orb):
+        return self.E_n[orb] + self.omega
+
+    def conjugateOrbital(self, orb):
+        return self.partner.phi_prev1[orb][-1]
+
+    def stateVersion(self): #The perturbed potentials also depend on the partner orbitals
+        return (self.orbVersion, self.orb1Version, self.partner.orb1Version)
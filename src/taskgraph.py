@@ -0,0 +1,99 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from vampyr import vampyr3d as vp
+
+class Task():
+    def __init__(self, key, func, deps = (), keep = False, estimate = None) -> None:
+        self.key = key
+        self.func = func          #called with the results of deps, in order
+        self.deps = list(deps)
+        self.keep = keep          #kept results are returned by TaskGraph.run, the others are freed after their last consumer
+        self.estimate = estimate  #optional estimate of the result size in kB, from the dependency results
+
+
+class TaskGraph():
+    """
+    DAG of tree operations run on a local thread pool. Dependencies must be added before the tasks using them, so the
+    graph cannot have cycles.
+    A task is started as soon as its dependencies are done. The result of a task that is not kept is dropped as soon as
+    its last consumer has finished, so intermediate trees (pair densities, pair potentials...) only live as long as needed.
+    With a memory limit, a ready task is only started if the live results plus the estimated results of the running tasks
+    stay below the limit. At least one task always runs, so a limit below the largest task slows the graph down but never
+    blocks it. The size of a result is estimated by the task estimate, or by its largest input by default.
+    """
+
+    def __init__(self) -> None:
+        self.tasks = {}
+        self.stats = {}
+
+    def add(self, key, func, deps = (), keep = False, estimate = None):
+        for dep in deps:
+            if dep not in self.tasks:
+                raise ValueError(f"Task {key} depends on {dep}, which is not in the graph yet")
+        self.tasks[key] = Task(key, func, deps, keep, estimate)
+        return key
+
+    def run(self, workers = 1, memoryLimitMB = None):
+        """
+        Returns:
+            dict: key -> result of every kept task
+        """
+        limit = None if memoryLimitMB is None else memoryLimitMB*1024.
+        consumers = {key: 0 for key in self.tasks}
+        children = {key: [] for key in self.tasks}
+        pending = {}
+        for key, task in self.tasks.items():
+            pending[key] = len(task.deps)
+            for dep in task.deps:
+                consumers[dep] += 1
+                children[dep].append(key)
+        ready = deque(key for key in self.tasks if pending[key] == 0)
+        results = {}
+        sizes = {}
+        live = 0.
+        reserved = 0.
+        peak = 0.
+        freed = 0
+        running = {}
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            while len(ready) > 0 or len(running) > 0:
+                while len(ready) > 0 and len(running) < workers:
+                    task = self.tasks[ready[0]]
+                    inputs = [results[dep] for dep in task.deps]
+                    estimate = task.estimate(*inputs) if task.estimate is not None else max([sizes[dep] for dep in task.deps], default=0.)
+                    if limit is not None and len(running) > 0 and live + reserved + estimate > limit:
+                        break
+                    ready.popleft()
+                    reserved += estimate
+                    running[pool.submit(task.func, *inputs)] = (task, estimate)
+                peak = max(peak, live + reserved)
+                done, notDone = wait(list(running), return_when=FIRST_COMPLETED)
+                for future in done:
+                    task, estimate = running.pop(future)
+                    reserved -= estimate
+                    results[task.key] = future.result()
+                    sizes[task.key] = resultSize(results[task.key])
+                    live += sizes[task.key]
+                    peak = max(peak, live + reserved)
+                    #Free the inputs whose last consumer this was, and the result itself if nobody needs it
+                    for key in task.deps + [task.key]:
+                        if key != task.key:
+                            consumers[key] -= 1
+                        if consumers[key] == 0 and not self.tasks[key].keep and key in results:
+                            del results[key]
+                            live -= sizes.pop(key)
+                            freed += 1
+                    for child in children[task.key]:
+                        pending[child] -= 1
+                        if pending[child] == 0:
+                            ready.append(child)
+        self.stats = {"tasks": len(self.tasks), "freed": freed, "peakMB": peak/1024.}
+        return {key: results[key] for key, task in self.tasks.items() if task.keep}
+
+
+def resultSize(result): #Size in kB of the trees of a task result
+    if isinstance(result, vp.FunctionTree):
+        return result.getSizeNodes()
+    if isinstance(result, (list, tuple)):
+        return sum(resultSize(item) for item in result)
+    return 0.
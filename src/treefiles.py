@@ -0,0 +1,115 @@
+import os
+import tempfile
+import itertools
+import threading
+from collections import OrderedDict
+from vampyr import vampyr3d as vp
+
+#Transport of FunctionTrees between the solver and worker processes through tree files.
+#vampyr only serialises trees through saveTree/loadTree, so every transfer is a file write and a full copy on load.
+#The files go to /dev/shm (tmpfs) when it is available, which avoids the disk but not the copies, and only a small
+#handle is pickled for the workers. Every tree is written once per batch however many tasks use it, and a worker
+#process loads a written tree only once per batch (loadCached).
+
+def ramDirectory(): #RAM-backed directory for the tree files, the temporary directory if /dev/shm is not available
+    if os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK):
+        return "/dev/shm"
+    return tempfile.gettempdir()
+
+
+class TreeHandle():
+    """
+    Picklable reference to a tree file of a TreeFileStore. Published files are never modified, so a path identifies the tree.
+    batch identifies the batch of the store the file belongs to, the file is deleted when the batch is released.
+    """
+
+    def __init__(self, path, batch = None) -> None:
+        self.path = path
+        self.batch = batch
+
+    def load(self, mra): #New tree read from the file
+        tree = vp.FunctionTree(mra)
+        tree.loadTree(self.path)
+        return tree
+
+    def exists(self):
+        return os.path.exists(self.path + ".tree")
+
+
+class TreeFileStore():
+    """
+    Writes trees of the main process for the worker processes and collects the trees they produce.
+    - publish(tree): writes the tree once and returns its handle, the same tree published again gets the same handle
+    - output(): handle of a file for a worker result, read back with fetch
+    - release(): deletes the files of the current batch and starts a new one
+    """
+
+    def __init__(self, directory = None) -> None:
+        self.tmpdir = tempfile.TemporaryDirectory(prefix="scfsolv_trees_", dir=directory if directory is not None else ramDirectory())
+        self.published = {}  #id(tree) -> (tree, handle), the tree is referenced so that its id is not reused
+        self.outputs = []
+        self.counter = itertools.count()
+        self.batch = 0
+        self.lock = threading.Lock()
+
+    def newPath(self):
+        return f"{self.tmpdir.name}/tree_{os.getpid()}_{next(self.counter)}"
+
+    def publish(self, tree):
+        with self.lock:
+            entry = self.published.get(id(tree))
+            if entry is not None:
+                return entry[1]
+            handle = TreeHandle(self.newPath(), (self.tmpdir.name, self.batch))
+            self.published[id(tree)] = (tree, handle)
+        tree.saveTree(handle.path)
+        return handle
+
+    def output(self):
+        with self.lock:
+            handle = TreeHandle(self.newPath(), (self.tmpdir.name, self.batch))
+            self.outputs.append(handle)
+        return handle
+
+    def fetch(self, handle, mra):
+        return handle.load(mra)
+
+    def release(self):
+        with self.lock:
+            handles = [handle for tree, handle in self.published.values()] + self.outputs
+            self.published = {}
+            self.outputs = []
+            self.batch += 1
+        for handle in handles:
+            if handle.exists():
+                os.remove(handle.path + ".tree")
+
+    def close(self):
+        self.release()
+        self.tmpdir.cleanup()
+
+
+#Worker side: trees of the current batch already loaded by this process, least recently used first
+loaded = OrderedDict()
+loadedBatch = None
+maxLoaded = 64
+
+def loadCached(handle, mra):
+    """
+    Tree of handle in a worker process, loaded from its file. A tree used by several tasks of the same worker and batch
+    (e.g. an orbital in many pair potentials) is only loaded by the first one. The trees of the previous batches are dropped, their files
+    are gone and they are never looked up again.
+    """
+    global loadedBatch
+    if handle.batch != loadedBatch:
+        loaded.clear()
+        loadedBatch = handle.batch
+    tree = loaded.get(handle.path)
+    if tree is None:
+        tree = handle.load(mra)
+        loaded[handle.path] = tree
+        while len(loaded) > maxLoaded:
+            loaded.popitem(last=False)
+    else:
+        loaded.move_to_end(handle.path)
+    return tree
@@ -1,7 +1,7 @@
 from vampyr import vampyr3d as vp
 import numpy as np
-import matplotlib.pyplot as plt
 from copy import deepcopy
+from operator import itemgetter
 
 
 # zero function
@@ -32,4 +32,23 @@ def Flin(r, Direction):
         return r[Direction]
 
 def Fx(r):
-     return r[0]
\ No newline at end of file
+     return r[0]
+
+#Same as Flin, but as a C-level callable: no Python frame is created per quadrature point
+def FlinGetter(Direction):
+    return itemgetter(Direction)
+
+#Linear combination Sum_j coefs[j]*trees[j] built in a single adaptive addition pass, zero coefficients are skipped
+def linCombOne(coefs, trees, prec, mra):
+    terms = [(float(coefs[j]), trees[j]) for j in range(len(trees)) if coefs[j] != 0.]
+    out = vp.FunctionTree(mra)
+    if len(terms) == 0:
+        out.setZero()
+    else:
+        vp.advanced.add(prec, out, terms)
+    return out
+
+#Linear combinations out_i = Sum_j C[i,j]*trees[j] for every row of the coefficient matrix C
+def linComb(C, trees, prec, mra):
+    C = np.atleast_2d(C)
+    return [linCombOne(C[i], trees, prec, mra) for i in range(C.shape[0])]
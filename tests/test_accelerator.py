@@ -0,0 +1,27 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("vampyr")
+import accelerator
+
+def test_crop_coefficients_minimise_residual():
+    rng = np.random.default_rng(2)
+    R = rng.standard_normal((3, 8))
+    B = np.dot(R, R.T)
+    c = accelerator.cropCoefficients(B)
+    #Constrained minimum of c^T B c under Sum c = 1: c = B^-1 1/(1^T B^-1 1)
+    w = np.linalg.solve(B, np.ones(3))
+    assert c.sum() == pytest.approx(1.)
+    assert np.allclose(c, w/w.sum())
+
+def test_crop_coefficients_singular():
+    #Identical residuals close to convergence make B singular, the coefficients must stay finite
+    r = np.ones(5)
+    B = np.outer([np.dot(r, r)]*2, [1., 1.])
+    c = accelerator.cropCoefficients(B)
+    assert np.all(np.isfinite(c))
+    assert c.sum() == pytest.approx(1.)
+
+def test_accelerator_is_abstract():
+    with pytest.raises(TypeError):
+        accelerator.Accelerator()
@@ -0,0 +1,50 @@
+import json
+import numpy as np
+import pytest
+
+vp = pytest.importorskip("vampyr").vampyr3d
+import checkpoint
+from scfsolv import scfsolv
+
+def heliumSolver():
+    solver = scfsolv(1.0e-3, 3)
+    pos = [0.1, 0.1, 0.1]
+    guess = vp.GaussExp()
+    guess.append(vp.GaussFunc(exp=0.808, coef=1., pos=pos, pow=[0,0,0]))
+    phi = solver.P_eps(guess)
+    phi.normalize()
+    solver.init_orbitals([pos], [2], [phi])
+    return solver
+
+def test_solver_round_trip(tmp_path):
+    solver = heliumSolver()
+    solver.enableCheckpoints(str(tmp_path))
+    solver.scfRun(1.0e-3, maxIter=2)
+    solver.saveCheckpoint(force=True)
+    solver.checkpointer.wait()
+
+    restored = scfsolv(1.0e-3, 3)
+    restored.restart(str(tmp_path))
+    assert restored.iteration == solver.iteration
+    assert restored.Norb == solver.Norb
+    assert np.allclose(restored.Fock, solver.Fock)
+    assert np.allclose(restored.E_n, solver.E_n)
+    for orb in range(solver.Norb):
+        assert len(restored.phi_prev[orb]) == len(solver.phi_prev[orb])
+        assert len(restored.f_prev[orb]) == len(solver.f_prev[orb])
+        diff = restored.phi_prev[orb][-1] - solver.phi_prev[orb][-1]
+        assert diff.norm() < 1.0e-10
+    #The resumed run continues from the same state
+    assert restored.expandSolution()[0] == pytest.approx(solver.expandSolution()[0])
+
+def test_keeps_the_latest_checkpoints(tmp_path):
+    solver = heliumSolver()
+    ckpt = checkpoint.Checkpointer(str(tmp_path), every=1, keep=2)
+    for iteration in range(4):
+        ckpt.save(solver, iteration)
+    ckpt.close()
+    assert len(ckpt.completed()) == 2
+    with open(tmp_path / "manifest.json") as f:
+        manifest = json.load(f)
+    assert manifest["latest"] == ckpt.completed()[-1]
+    assert manifest["iteration"] == 3
@@ -0,0 +1,28 @@
+import pytest
+
+vp = pytest.importorskip("vampyr").vampyr3d
+import opcache
+from scfsolv import scfsolv
+
+def heliumEnergy(muTol, prec = 1.0e-3):
+    solver = scfsolv(prec, 3)
+    solver.helmholtz = opcache.HelmholtzCache(muTol=muTol)
+    pos = [0.1, 0.1, 0.1]
+    guess = vp.GaussExp()
+    guess.append(vp.GaussFunc(exp=0.808, coef=1., pos=pos, pow=[0,0,0]))
+    phi = solver.P_eps(guess)
+    phi.normalize()
+    solver.init_orbitals([pos], [2], [phi])
+    solver.scfRun(prec)
+    return solver.E_n[0]
+
+def test_quantize_is_consistent_with_keys():
+    cache = opcache.HelmholtzCache(muTol=0.05)
+    assert cache.quantize(1.337) == pytest.approx(1.35)
+    assert cache.quantize(1.324) == pytest.approx(1.3)
+
+def test_cached_fixed_point_matches_exact_mu():
+    #A coarse muTol only changes the operators, not the converged energy
+    exact = heliumEnergy(1.0e-8)
+    cached = heliumEnergy(0.05)
+    assert cached == pytest.approx(exact, abs=1.0e-3)
@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+
+vp = pytest.importorskip("vampyr").vampyr3d
+import history
+
+@pytest.fixture
+def mra():
+    world = vp.BoundingBox(corner=[-1]*3, nboxes=[2]*3, scaling=[1.0]*3, scale=-4)
+    return vp.MultiResolutionAnalysis(order=5, box=world)
+
+def gaussians(mra, n):
+    P_eps = vp.ScalingProjector(mra, 1.0e-3)
+    trees = []
+    for k in range(n):
+        g = vp.GaussExp()
+        g.append(vp.GaussFunc(exp=1. + k, coef=1., pos=[0.1*k, 0., 0.], pow=[0,0,0]))
+        trees.append(P_eps(g))
+    return trees
+
+def test_spill_and_reload(mra, tmp_path):
+    trees = gaussians(mra, 4)
+    norms = [tree.norm() for tree in trees]
+    #A budget below one tree: every tree but the most recent one is spilled to disk
+    store = history.HistoryStore(mra, budgetMB=1e-9, directory=str(tmp_path))
+    hist = store.newHistory(trees)
+    assert store.stats()["saves"] == 3
+    assert len(history.residentTrees(hist)) == 1
+    reloaded = [hist[i].norm() for i in range(len(hist))]
+    assert np.allclose(reloaded, norms)
+    assert store.stats()["loads"] >= 3
+
+def test_remove_deletes_files(mra, tmp_path):
+    store = history.HistoryStore(mra, budgetMB=1e-9, directory=str(tmp_path))
+    hist = store.newHistory(gaussians(mra, 3))
+    del hist[0]
+    assert len(hist) == 2
+    hist.clear()
+    assert store.stats()["resident"] == 0
+    assert store.stats()["onDisk"] == 0
+    assert list(tmp_path.glob("*.tree")) == []
@@ -0,0 +1,25 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("vampyr")
+import KAIN
+
+def histories(m, n = 12, seed = 0):
+    rng = np.random.default_rng(seed)
+    return rng.standard_normal((m+1, n)), rng.standard_normal((m+1, n))
+
+def test_kain_system_matches_direct_products():
+    phis, fs = histories(4)
+    A, b = KAIN.kainLinearSystem(np.dot(phis, fs.T))
+    dphi = phis[:-1] - phis[-1]
+    df = fs[:-1] - fs[-1]
+    assert np.allclose(A, -np.dot(dphi, df.T))
+    assert np.allclose(b, np.dot(dphi, fs[-1]))
+
+def test_kain_solution_matches_direct_solve():
+    phis, fs = histories(3, seed=1)
+    A, b = KAIN.kainLinearSystem(np.dot(phis, fs.T))
+    dphi = phis[:-1] - phis[-1]
+    df = fs[:-1] - fs[-1]
+    direct = np.linalg.solve(-np.dot(dphi, df.T), np.dot(dphi, fs[-1]))
+    assert np.allclose(np.linalg.solve(A, b), direct)
@@ -0,0 +1,41 @@
+import pytest
+
+vp = pytest.importorskip("vampyr").vampyr3d
+import observers
+from scfsolv import scfsolv
+
+class RecordingObserver(observers.ScfObserver):
+    events = ("iteration",)
+
+    def __init__(self) -> None:
+        self.received = []
+
+    def notify(self, event, solver, data):
+        self.received.append((event, data))
+
+def test_emit_dispatches_wanted_events_only():
+    solver = scfsolv(1.0e-3, 3)
+    observer = RecordingObserver()
+    solver.addObserver(observer)
+    solver.emit("iteration", lambda : {"iteration": 1})
+    solver.emit("overlap", lambda : {"S": None})
+    assert observer.received == [("iteration", {"iteration": 1})]
+    solver.removeObserver(observer)
+    solver.emit("iteration", lambda : {"iteration": 2})
+    assert len(observer.received) == 1
+
+def test_payload_not_built_without_listener():
+    #The headless default: diagnostics are never evaluated
+    solver = scfsolv(1.0e-3, 3)
+    solver.addObserver(observers.ScfObserver())
+    solver.diagnostic("never", lambda : pytest.fail("payload evaluated without listener"))
+
+def test_print_observer(capsys):
+    printer = observers.PrintObserver()
+    assert not printer.wants("diagnostic")
+    printer.notify("finish", None, {"iterations": 4})
+    assert "Converged after 4 iterations" in capsys.readouterr().out
+
+def test_from_flags():
+    assert observers.fromFlags() == []
+    assert isinstance(observers.fromFlags(printVal=True)[0], observers.PrintObserver)
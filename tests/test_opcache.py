@@ -0,0 +1,30 @@
+import pytest
+
+pytest.importorskip("vampyr")
+import opcache
+
+def test_iteration_cache_hits_within_a_version():
+    cache = opcache.IterationCache()
+    calls = []
+    build = lambda : calls.append(1) or len(calls)
+    assert cache.lookup("fock", 1, build) == 1
+    assert cache.lookup("fock", 1, build) == 1
+    assert len(calls) == 1
+    assert cache.stats() == {"hits": 1, "misses": 1, "entries": 1}
+
+def test_iteration_cache_evicts_outdated_entries():
+    cache = opcache.IterationCache()
+    cache.store(("Fphi", 0), 1, "old")
+    #A lookup with another version is a miss and drops the outdated entry
+    assert cache.get(("Fphi", 0), 2) is None
+    assert cache.stats() == {"hits": 0, "misses": 1, "entries": 0}
+    assert cache.lookup(("Fphi", 0), 2, lambda : "new") == "new"
+    assert cache.get(("Fphi", 0), 2) == "new"
+
+def test_iteration_cache_keys_are_independent():
+    cache = opcache.IterationCache()
+    cache.store(("Fphi", 0), 1, "phi0")
+    cache.store(("Fphi", 1), 1, "phi1")
+    assert cache.get(("Fphi", 1), 1) == "phi1"
+    cache.clear()
+    assert cache.get(("Fphi", 0), 1) is None
@@ -0,0 +1,29 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("vampyr")
+import ortho
+
+def overlap(n = 5, seed = 0):
+    rng = np.random.default_rng(seed)
+    C = np.eye(n) + 0.2*rng.standard_normal((n, n))
+    return np.dot(C, C.T)
+
+def test_lowdin_orthonormalises():
+    S = overlap()
+    X, U = ortho.lowdinMatrix(S)
+    assert np.allclose(X, X.T)
+    assert np.allclose(np.dot(X, np.dot(S, X)), np.eye(S.shape[0]))
+
+def test_cholesky_orthonormalises():
+    S = overlap(seed=1)
+    Linv = ortho.choleskyMatrix(S)
+    assert np.array_equal(Linv, np.tril(Linv))
+    assert np.allclose(np.dot(Linv, np.dot(S, Linv.T)), np.eye(S.shape[0]))
+
+def test_is_orthonormal():
+    S = np.eye(3)
+    assert ortho.isOrthonormal(S, 1e-10)
+    S[0, 1] = S[1, 0] = 1e-3
+    assert ortho.isOrthonormal(S, 1e-2)
+    assert not ortho.isOrthonormal(S, 1e-4)
@@ -0,0 +1,28 @@
+import threading
+import pytest
+
+pytest.importorskip("vampyr")
+import parallel
+
+def runWithTimeout(func, timeout = 10.):
+    out = {}
+    thread = threading.Thread(target=lambda : out.setdefault("result", func()), daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), "the executor deadlocked"
+    return out["result"]
+
+def test_nested_map_single_worker():
+    executor = parallel.OrbitalExecutor("thread", workers=1)
+    try:
+        result = runWithTimeout(lambda : executor.map(lambda i : executor.map(lambda j : 10*i + j, range(5)), range(3)))
+    finally:
+        executor.shutdown()
+    assert result == [[10*i + j for j in range(5)] for i in range(3)]
+
+def test_map_keeps_order():
+    executor = parallel.OrbitalExecutor("thread", workers=4)
+    try:
+        assert executor.map(lambda i : i*i, range(20)) == [i*i for i in range(20)]
+    finally:
+        executor.shutdown()
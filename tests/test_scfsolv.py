@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+
+vp = pytest.importorskip("vampyr").vampyr3d
+from scfsolv import scfsolv
+
+def gaussian(solver, exp):
+    g = vp.GaussExp()
+    g.append(vp.GaussFunc(exp=exp, coef=1., pos=[0.1, 0.1, 0.1], pow=[0,0,0]))
+    tree = solver.P_eps(g)
+    tree.normalize()
+    return tree
+
+@pytest.mark.parametrize("khist", [0, 1])
+def test_correct_orbital_short_kain_history(khist):
+    solver = scfsolv(1.0e-3, khist)
+    #History of one orbital as left by init_orbitals: the guess and one power iteration
+    phis = [gaussian(solver, 1.0), gaussian(solver, 1.1)]
+    solver.Norb = 1
+    solver.phi_prev = [solver.newHistory(phis)]
+    solver.f_prev = [solver.newHistory([phis[1] - phis[0]])]
+    solver.resetAccelerators()
+    for step in range(3):
+        norm, update = solver.correctOrbital(0, gaussian(solver, 1.2 + 0.1*step))
+        #The original KAIN loop drops one entry per iteration, two iterates stay
+        assert len(solver.phi_prev[0]) == 2
+        assert len(solver.f_prev[0]) == 1
+        assert np.isfinite(update)
+
+def test_init_orbitals_invalidates_guess_operators():
+    #A single orbital is already orthonormal, the operators of the guess must not be reused after the power iteration
+    solver = scfsolv(1.0e-3, 3)
+    solver.init_orbitals([[0.1, 0.1, 0.1]], [2], [gaussian(solver, 0.808)])
+    solver.compFock()
+    fock = solver.Fock.copy()
+    solver.cache.clear()
+    solver.compFock()
+    assert fock == pytest.approx(solver.Fock)
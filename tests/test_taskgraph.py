@@ -0,0 +1,50 @@
+import threading
+import time
+import pytest
+
+pytest.importorskip("vampyr")
+from taskgraph import TaskGraph
+
+def test_dependencies_must_exist():
+    graph = TaskGraph()
+    with pytest.raises(ValueError):
+        graph.add("b", lambda a : a, deps=["a"])
+
+def test_results_and_freed_intermediates():
+    graph = TaskGraph()
+    graph.add("a", lambda : 2)
+    graph.add("b", lambda a : a + 1, deps=["a"])
+    graph.add("c", lambda a, b : a*b, deps=["a", "b"], keep=True)
+    graph.add("d", lambda c : -c, deps=["c"], keep=True)
+    results = graph.run(workers=2)
+    assert results == {"c": 6, "d": -6}
+    #a and b are dropped after their last consumer, the kept results are not
+    assert graph.stats["freed"] == 2
+    assert graph.stats["tasks"] == 4
+
+def test_memory_limit_serialises_tasks():
+    lock = threading.Lock()
+    state = {"running": 0, "max": 0}
+    def work(i):
+        with lock:
+            state["running"] += 1
+            state["max"] = max(state["max"], state["running"])
+        time.sleep(0.01)
+        with lock:
+            state["running"] -= 1
+        return i
+    graph = TaskGraph()
+    for i in range(6):
+        graph.add(("t", i), lambda i=i : work(i), keep=True, estimate=lambda : 10.)
+    #Room for a single 10 kB task at a time
+    results = graph.run(workers=4, memoryLimitMB=15./1024.)
+    assert results == {("t", i): i for i in range(6)}
+    assert state["max"] == 1
+    assert graph.stats["peakMB"]*1024. <= 15.
+
+def test_without_limit_tasks_run_concurrently():
+    barrier = threading.Barrier(2, timeout=5)
+    graph = TaskGraph()
+    for i in range(2):
+        graph.add(i, lambda : barrier.wait() is not None, keep=True)
+    assert graph.run(workers=2) == {0: True, 1: True}